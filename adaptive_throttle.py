@@ -0,0 +1,204 @@
+"""
+Adaptive per-domain rate control for the MyAnimeList spiders.
+
+Replaces a fixed DOWNLOAD_DELAY. Each download slot (one per domain) gets its own
+delay, adjusted after every response:
+
+    healthy response, latency under target -> ramp up: the request rate grows by
+                                              ADAPTIVE_THROTTLE_RATE_STEP req/s per second
+    latency over target                     -> ease off: delay x 1.25
+    429 / 503 / other 5xx / timeouts        -> back off: delay x ADAPTIVE_THROTTLE_BACKOFF_FACTOR
+    Retry-After on a 429 / 503              -> nothing is sent to that domain until it has passed
+
+After a back-off the rate only starts growing again once ADAPTIVE_THROTTLE_RECOVERY
+healthy responses in a row came back. The retry itself is left to Scrapy's
+RetryMiddleware, which already retries 429 and 5xx.
+
+Settings (defaults in brackets):
+    ADAPTIVE_THROTTLE_ENABLED          [True]
+    ADAPTIVE_THROTTLE_START_DELAY      [1.0]  seconds between requests at the start
+    ADAPTIVE_THROTTLE_MIN_DELAY        [0.25]
+    ADAPTIVE_THROTTLE_MAX_DELAY        [60.0]
+    ADAPTIVE_THROTTLE_TARGET_LATENCY   [2.0]  seconds
+    ADAPTIVE_THROTTLE_RATE_STEP        [0.5]  req/s gained per second of healthy responses
+    ADAPTIVE_THROTTLE_BACKOFF_FACTOR   [2.0]
+    ADAPTIVE_THROTTLE_RECOVERY         [5]
+    ADAPTIVE_THROTTLE_MAX_RETRY_AFTER  [300]  seconds, longer Retry-After values are capped
+
+Crawl stats, per slot: adaptive_throttle/<domain>/delay, /rate, /latency_ms,
+/error_rate, /state (ramping, steady, slowing, backoff), /backoffs, /retry_after,
+/status_<code>, plus /min_delay and /max_delay reached during the crawl.
+"""
+import logging
+import time
+from email.utils import parsedate_to_datetime
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_STATUSES = {429, 503}
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SlotState:
+    """What the throttle knows about one download slot."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.latency = None  # moving average, seconds
+        self.error_rate = 0.0  # moving average of "this response was an error"
+        self.good_streak = 0
+        self.pause_until = 0.0
+        self.last_backoff = 0.0
+        self.randomize_delay = None  # the slot's own setting while a pause overrides it
+        self.state = 'ramping'
+        self.min_delay_seen = delay
+        self.max_delay_seen = delay
+
+
+class AdaptiveThrottleMiddleware:
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED', True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_delay = settings.getfloat('ADAPTIVE_THROTTLE_START_DELAY', 1.0)
+        self.min_delay = settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY', 0.25)
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', 60.0)
+        self.target_latency = settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY', 2.0)
+        self.rate_step = settings.getfloat('ADAPTIVE_THROTTLE_RATE_STEP', 0.5)
+        self.backoff_factor = settings.getfloat('ADAPTIVE_THROTTLE_BACKOFF_FACTOR', 2.0)
+        self.recovery = settings.getint('ADAPTIVE_THROTTLE_RECOVERY', 5)
+        self.max_retry_after = settings.getfloat('ADAPTIVE_THROTTLE_MAX_RETRY_AFTER', 300.0)
+        self.slots = {}
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        # New download slots take their initial delay from the spider
+        spider.download_delay = self.start_delay
+
+    def downloader_slot(self, request):
+        key = request.meta.get('download_slot')
+        if key is None:
+            return None, None
+        slot = self.crawler.engine.downloader.slots.get(key)
+        return key, slot
+
+    def state_for(self, key):
+        if key not in self.slots:
+            self.slots[key] = SlotState(self.start_delay)
+        return self.slots[key]
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response  # served from the page cache, says nothing about the server
+        key, slot = self.downloader_slot(request)
+        if slot is None:
+            return response
+        state = self.state_for(key)
+        self.stats.inc_value(f'adaptive_throttle/{key}/status_{response.status}')
+
+        if response.status in BACKOFF_STATUSES or response.status >= 500:
+            retry_after = None
+            if response.status in BACKOFF_STATUSES:
+                retry_after = parse_retry_after(response.headers.get(b'Retry-After'))
+            self.back_off(key, state, f'HTTP {response.status}', retry_after)
+        else:
+            self.on_success(state, request.meta.get('download_latency'))
+        self.apply(key, slot, state)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        key, slot = self.downloader_slot(request)
+        if slot is not None:
+            state = self.state_for(key)
+            self.back_off(key, state, type(exception).__name__, None)
+            self.apply(key, slot, state)
+        return None
+
+    def on_success(self, state, latency):
+        state.error_rate *= 0.9
+        if latency is not None:
+            state.latency = latency if state.latency is None else 0.7 * state.latency + 0.3 * latency
+        if state.latency is not None and state.latency > self.target_latency:
+            state.delay = min(self.max_delay, state.delay * 1.25)
+            state.good_streak = 0
+            state.state = 'slowing'
+            return
+
+        state.good_streak += 1
+        if state.good_streak < self.recovery and state.state == 'backoff':
+            return
+        # Additive increase of the rate: about rate_step req/s more for every second of healthy responses
+        rate = 1.0 / state.delay
+        rate += self.rate_step / rate
+        state.delay = max(self.min_delay, 1.0 / rate)
+        state.state = 'steady' if state.delay <= self.min_delay else 'ramping'
+
+    def back_off(self, key, state, reason, retry_after):
+        state.error_rate = state.error_rate * 0.9 + 0.1
+        state.good_streak = 0
+        now = time.time()
+        # Requests already in flight when the server pushed back fail together; count that as one back-off
+        if now - state.last_backoff >= state.delay:
+            state.delay = min(self.max_delay, max(state.delay, self.min_delay) * self.backoff_factor)
+            state.last_backoff = now
+        state.state = 'backoff'
+        self.stats.inc_value(f'adaptive_throttle/{key}/backoffs')
+        if retry_after is not None:
+            retry_after = min(retry_after, self.max_retry_after)
+            state.pause_until = max(state.pause_until, now + retry_after)
+            self.stats.inc_value(f'adaptive_throttle/{key}/retry_after')
+        logger.debug(f"Backing off {key} ({reason}): delay {state.delay:.2f}s"
+                     + (f", Retry-After {retry_after:.1f}s" if retry_after is not None else ''))
+
+    def apply(self, key, slot, state):
+        # While a Retry-After is pending the slot delay covers the rest of the pause,
+        # without RANDOMIZE_DOWNLOAD_DELAY shortening it. The downloader counts the delay
+        # from the slot's last request (lastseen), so the pause is measured from there too
+        pause = state.pause_until - (slot.lastseen or time.time())
+        if pause > state.delay:
+            if state.randomize_delay is None:
+                state.randomize_delay = slot.randomize_delay
+            slot.randomize_delay = False
+            slot.delay = pause
+        else:
+            if state.randomize_delay is not None:
+                slot.randomize_delay = state.randomize_delay
+                state.randomize_delay = None
+            slot.delay = state.delay
+        state.min_delay_seen = min(state.min_delay_seen, state.delay)
+        state.max_delay_seen = max(state.max_delay_seen, state.delay)
+
+        prefix = f'adaptive_throttle/{key}'
+        self.stats.set_value(f'{prefix}/delay', round(state.delay, 3))
+        self.stats.set_value(f'{prefix}/rate', round(1.0 / state.delay, 3))
+        self.stats.set_value(f'{prefix}/error_rate', round(state.error_rate, 3))
+        self.stats.set_value(f'{prefix}/state', state.state)
+        self.stats.set_value(f'{prefix}/min_delay', round(state.min_delay_seen, 3))
+        self.stats.set_value(f'{prefix}/max_delay', round(state.max_delay_seen, 3))
+        if state.latency is not None:
+            self.stats.set_value(f'{prefix}/latency_ms', round(state.latency * 1000, 1))
@@ -1,18 +1,76 @@
 import scrapy
 import logging
+from scrapy.settings import SETTINGS_PRIORITIES
+
+from crawl_stats import timed_parse
+from mal_parsing import anime_id_from_url, canonical_anime_url
+from ranking_delta import RankingDelta
+
+# This spider has always named these two detail fields differently from detail_data.py
+DETAIL_KEY_NAMES = {'anime_type': 'type', 'score': 'score_detail'}
 
 class AnimeSpider(scrapy.Spider):
     name = "anime"
     allowed_domains = ["myanimelist.net"]
-    start_urls = ["https://myanimelist.net/topanime.php?limit=0"]
+    list_url = "https://myanimelist.net/topanime.php?limit={limit}"
 
-    # Add a download delay to avoid being blocked
+    # Pace requests to avoid being blocked: adaptive_throttle.py starts at the old 2 second
+    # delay, speeds up while the site answers quickly and backs off on 429/5xx/Retry-After
     custom_settings = {
-        'DOWNLOAD_DELAY': 2,  # 2 seconds delay between requests
+        'ADAPTIVE_THROTTLE_START_DELAY': 2,
+        'ADAPTIVE_THROTTLE_MIN_DELAY': 0.25,
+        'RETRY_TIMES': 5,  # rate-limited pages are retried once the throttle has backed off
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',
         'LOG_LEVEL': 'DEBUG',  # Enable debug logging
+        # Page cache, off unless -s PAGE_CACHE_MODE=revalidate|replay (see page_cache.py)
+        'DOWNLOADER_MIDDLEWARES': {
+            'page_cache.PageCacheMiddleware': 900,
+            'adaptive_throttle.AdaptiveThrottleMiddleware': 800,
+        },
+        # Timings export, off unless -s CRAWL_STATS_ENABLED=1 (see crawl_stats.py)
+        'EXTENSIONS': {'crawl_stats.CrawlStatsExtension': 500},
     }
 
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # Items straight into animelist.db with -s ANIME_DB=animelist.db. Only added then:
+        # Scrapy imports every listed pipeline, and a plain crawl does not need animetodb.py
+        if settings.get('ANIME_DB'):
+            pipelines = dict(settings.getdict('ITEM_PIPELINES'))
+            pipelines.setdefault('animetodb.AnimeDatabasePipeline', 300)
+            # Same priority as any -s ITEM_PIPELINES, which would otherwise win over this one
+            priority = max(settings.getpriority('ITEM_PIPELINES') or 0, SETTINGS_PRIORITIES['spider'])
+            settings.set('ITEM_PIPELINES', pipelines, priority=priority)
+
+    def __init__(self, previous=None, carry=None, snapshot_out=None, score_threshold=0.01,
+                 members_threshold=0.05, rank_threshold=10, last_limit=4400, *args, **kwargs):
+        """
+        last_limit   -- limit= of the last ranking page, 50 titles per page (4400 = 89 pages)
+
+        Incremental mode (see ranking_delta.py), all optional:
+        previous     -- last ranking snapshot (animedata.json, a saved snapshot or animelist.db);
+                        only new titles and titles whose score/members/rank moved are re-fetched
+        carry        -- previous output of this spider, unchanged titles are re-emitted from it
+        snapshot_out -- where to write this run's ranking snapshot for the next run
+        """
+        super().__init__(*args, **kwargs)
+        self.ranking = RankingDelta(previous, carry, float(score_threshold),
+                                    float(members_threshold), int(rank_threshold))
+        self.incremental = previous is not None
+        self.snapshot_out = snapshot_out
+        self.last_limit = int(last_limit)
+        # MAL ids already requested this run; rankings shift during the crawl and the
+        # same title can turn up on two list pages
+        self.seen_ids = set()
+
+    def start_requests(self):
+        # Every list page is known up front, so schedule them all at once; the downloader's
+        # per-domain concurrency and the adaptive throttle bound how many run together.
+        # Higher priority than detail pages keeps the ranking read early in the crawl.
+        for limit in range(0, self.last_limit + 1, 50):
+            yield scrapy.Request(url=self.list_url.format(limit=limit), callback=self.parse, priority=1)
+
     def clean_data(self, data):
         """
         Helper function to clean extracted data.
@@ -35,7 +93,30 @@ class AnimeSpider(scrapy.Spider):
             title = anime.css('h3.fl-l.fs14.fw-b.anime_ranking_h3 a::text').get()
             image_url = anime.css('a.hoverinfo_trigger.fl-l.ml12.mr8 img::attr(data-src)').get()
             score = anime.css('span.score-label::text').get()
-            anime_url = anime.css('h3.fl-l.fs14.fw-b.anime_ranking_h3 a::attr(href)').get()
+            anime_url = canonical_anime_url(anime.css('h3.fl-l.fs14.fw-b.anime_ranking_h3 a::attr(href)').get())
+            rank = anime.css('td.rank span::text').get()
+            info_text = self.clean_data(anime.css('.information.di-ib.mt4::text').getall())
+            members = info_text[2] if len(info_text) > 2 else None
+
+            anime_id = anime_id_from_url(anime_url)
+            if anime_id is not None:
+                if anime_id in self.seen_ids:
+                    self.crawler.stats.inc_value('dedupe/duplicate_anime')
+                    continue
+                self.seen_ids.add(anime_id)
+
+            status = self.ranking.classify(title, anime_url, score, members, rank)
+            if self.incremental:
+                self.crawler.stats.inc_value(f'incremental/{status}')
+            if self.incremental and status == 'unchanged':
+                carried = self.ranking.carried_item(title, anime_url)
+                if carried is not None:
+                    self.crawler.stats.inc_value('incremental/carried')
+                    yield carried
+                    continue
+                # Nothing to carry (no -a carry, or the title is missing from it): fetch it,
+                # otherwise it would stay unchanged against the snapshot and never be emitted
+                self.crawler.stats.inc_value('incremental/refetch_no_carry')
 
             # Yield a Request for each anime's detail page
             yield scrapy.Request(
@@ -44,93 +125,27 @@ class AnimeSpider(scrapy.Spider):
                 meta={'title': title, 'image_url': image_url, 'score': score}
             )
 
-        # Handle pagination using the `limit` parameter
-        current_limit = int(response.url.split('=')[-1])  # Extract the current limit value
-        next_limit = current_limit + 50  # Increment by 50 for the next page
-
-        # Stop pagination after a certain limit (e.g., 4400 for 88 pages)
-        if next_limit <= 4400:
-            next_page_url = f"https://myanimelist.net/topanime.php?limit={next_limit}"
-            logging.info(f"Found next page: {next_page_url}")
-            yield scrapy.Request(url=next_page_url, callback=self.parse)
-        else:
-            logging.info("No more pages found.")
-
     def parse_anime_page(self, response):
         try:
-            # Extract detailed information using provided selectors
-            description = self.clean_data(response.xpath('//p[@itemprop="description"]/text() | //p[@itemprop="description"]/br/following-sibling::text()').getall())
-            character_names = self.clean_data(response.xpath('//td[@class="borderClass"]/h3[@class="h3_characters_voice_actors"]/a/text()').getall())
-            character_types = self.clean_data(response.xpath('//td[@class="borderClass"]/div[@class="spaceit_pad"]/small/text()').getall())
-            voice_actor_names = self.clean_data(response.xpath('//td[@class="va-t ar pl4 pr4"]/a/text()').getall())
-            languages = self.clean_data(response.xpath('//td[@class="va-t ar pl4 pr4"]/small/text()').getall())
-            character_images = self.clean_data(response.css('div.picSurround img::attr(data-src)').getall())
-            voice_actor_images = self.clean_data(response.css('td.va-t.ar.pl4.pr4 + td div.picSurround img::attr(data-src)').getall())
-
-            # Extract review ratios
-            statuses = self.clean_data(response.css('div.review-ratio__box a::text').getall())
-            numbers = self.clean_data(response.css('div.review-ratio__box a strong::text').getall())
-
-            # Extract additional information
-            synonyms = self.clean_data(response.xpath('//div[@class="spaceit_pad"][contains(., "Synonyms")]/text()').getall())
-            japanese_title = self.clean_data(response.xpath('//div[@class="spaceit_pad"][contains(., "Japanese")]/text()').getall())
-            english_title = self.clean_data(response.xpath('//div[@class="spaceit_pad"][contains(., "English")]/text()').getall())
-            anime_type = self.clean_data(response.css('div.spaceit_pad:contains("Type") a::text').get())
-            episodes = self.clean_data(response.css('div.spaceit_pad:contains("Episodes")::text').getall())
-            status = self.clean_data(response.css('div.spaceit_pad:contains("Status")::text').getall())
-            aired = self.clean_data(response.css('div.spaceit_pad:contains("Aired")::text').getall())
-            premiered = self.clean_data(response.css('div.spaceit_pad:contains("Premiered") a::text').get())
-            broadcast = self.clean_data(response.css('div.spaceit_pad:contains("Broadcast")::text').getall())
-            producers = self.clean_data(response.css('div.spaceit_pad:contains("Producers") a::text').getall())
-            licensors = self.clean_data(response.css('div.spaceit_pad:contains("Licensors") a::text').getall())
-            studios = self.clean_data(response.css('div.spaceit_pad:contains("Studios") a::text').getall())
-            source = self.clean_data(response.css('div.spaceit_pad:contains("Source") a::text').getall())
-            genres = self.clean_data(response.css('div.spaceit_pad:contains("Genres") a::text').getall())
-            themes = self.clean_data(response.css('div.spaceit_pad:contains("Themes") a::text').getall())
-            duration = self.clean_data(response.css('div.spaceit_pad:contains("Duration")::text').getall())
-            rating = self.clean_data(response.css('div.spaceit_pad:contains("Rating")::text').getall())
-            score = self.clean_data(response.css('span[itemprop="ratingValue"]::text').get())
-            ranked = self.clean_data(response.css('div.spaceit_pad:contains("Ranked")::text').getall())
-            popularity = self.clean_data(response.css('div.spaceit_pad:contains("Popularity")::text').getall())
-            members = self.clean_data(response.css('div.spaceit_pad:contains("Members")::text').getall())
-            favorites = self.clean_data(response.css('div.spaceit_pad:contains("Favorites")::text').getall())
+            # Extract detailed information with the shared single-pass parser
+            details = timed_parse(self, response)
 
             # Organize and yield the data
-            yield {
+            item = {
                 'title': self.clean_data(response.meta.get('title')),
                 'image_url': self.clean_data(response.meta.get('image_url')),
                 'score': self.clean_data(response.meta.get('score')),
-                'description': description,
-                'character_names': character_names,
-                'character_types': character_types,
-                'voice_actor_names': voice_actor_names,
-                'languages': languages,
-                'character_images': character_images,
-                'voice_actor_images': voice_actor_images,
-                'statuses': statuses,
-                'numbers': numbers,
-                'synonyms': synonyms,
-                'japanese_title': japanese_title,
-                'english_title': english_title,
-                'type': anime_type,
-                'episodes': episodes,
-                'status': status,
-                'aired': aired,
-                'premiered': premiered,
-                'broadcast': broadcast,
-                'producers': producers,
-                'licensors': licensors,
-                'studios': studios,
-                'source': source,
-                'genres': genres,
-                'themes': themes,
-                'duration': duration,
-                'rating': rating,
-                'score_detail': score,
-                'ranked': ranked,
-                'popularity': popularity,
-                'members': members,
-                'favorites': favorites,
+                'url': response.request.url,  # lets the next incremental run carry this item forward
             }
+            for key, value in details.items():
+                item[DETAIL_KEY_NAMES.get(key, key)] = value
+            yield item
         except Exception as e:
             logging.error(f"Error processing {response.url}: {e}")
+
+    def closed(self, reason):
+        if self.incremental:
+            logging.info(f"Incremental crawl: {self.ranking.counts}")
+        if self.snapshot_out:
+            self.ranking.save_snapshot(self.snapshot_out)
+            logging.info(f"Saved ranking snapshot to {self.snapshot_out}")
@@ -0,0 +1,278 @@
+"""
+Typed anime columns and a column-oriented NumPy snapshot of animelist.db.
+
+MyAnimeList gives us numbers as display text ("988,459", "#12", "TV (28 eps)",
+"1 hr. 55 min.", "Apr 5, 2009 to Jul 4, 2010"). The loader (Load Data to DataBase)
+uses typed_anime_values() to store them as real columns next to the original text:
+
+    members_count, rank_position, popularity_rank, favorites_count, episode_count,
+    aired_from, aired_to (ISO dates), duration_minutes
+
+export_snapshot() writes one .npy file per column plus a packed genre membership
+bitmap, and Snapshot opens them memory-mapped, so analyses are plain NumPy:
+
+    python anime_columns.py export --db animelist.db --out anime_snapshot
+    python anime_columns.py report --dir anime_snapshot --compare-db animelist.db
+"""
+import argparse
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from ranking_delta import parse_number
+
+# Typed column -> (SQL type, source text column)
+TYPED_COLUMNS = {
+    'members_count': ('INTEGER', 'members'),
+    'rank_position': ('INTEGER', 'ranked'),
+    'popularity_rank': ('INTEGER', 'popularity'),
+    'favorites_count': ('INTEGER', 'favorites'),
+    'episode_count': ('INTEGER', 'episodes'),
+    'aired_from': ('TEXT', 'aired'),
+    'aired_to': ('TEXT', 'aired'),
+    'duration_minutes': ('REAL', 'duration'),
+}
+
+# Snapshot column -> dtype. Integers use -1 and floats NaN for missing values, dates NaT.
+SNAPSHOT_COLUMNS = {
+    'anime_id': 'int64',
+    'score': 'float64',
+    'members_count': 'int64',
+    'rank_position': 'int64',
+    'popularity_rank': 'int64',
+    'favorites_count': 'int64',
+    'episode_count': 'int64',
+    'duration_minutes': 'float64',
+    'aired_from': 'datetime64[D]',
+    'aired_to': 'datetime64[D]',
+}
+MISSING_INT = -1
+
+DATE_FORMATS = ['%b %d, %Y', '%b, %Y', '%b %Y', '%Y']
+
+
+def parse_date(text):
+    """'Apr 5, 2009' / 'Apr 2009' / '2009' -> '2009-04-05' / '2009-04-01' / '2009-01-01', else None."""
+    text = (text or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_aired(text):
+    """'Apr 5, 2009 to Jul 4, 2010' (detail page) or 'Sep 2023 - Mar 2024' (ranking) -> (from, to)."""
+    if not text:
+        return None, None
+    parts = re.split(r'\s+(?:to|-)\s+', text.strip(), maxsplit=1)
+    aired_from = parse_date(parts[0])
+    # A single date (movies, specials) started and ended the same day
+    aired_to = parse_date(parts[1]) if len(parts) > 1 else aired_from
+    return aired_from, aired_to
+
+
+def parse_duration(text):
+    """'24 min. per ep.' -> 24.0, '1 hr. 55 min.' -> 115.0, '30 sec.' -> 0.5, 'Unknown' -> None."""
+    minutes = 0.0
+    found = False
+    for amount, unit in re.findall(r'(\d+)\s*(hr|min|sec)', text or ''):
+        minutes += int(amount) * {'hr': 60, 'min': 1, 'sec': 1 / 60}[unit]
+        found = True
+    return minutes if found else None
+
+
+def parse_episodes(text):
+    """'28' (detail page) or 'TV (28 eps)' (ranking) -> 28, 'Unknown' / 'TV (? eps)' -> None."""
+    return parse_number(text)
+
+
+def typed_anime_values(episodes, aired, duration, ranked, popularity, members, favorites):
+    """Typed values for one anime from its text fields, in TYPED_COLUMNS order."""
+    aired_from, aired_to = parse_aired(aired)
+    return (
+        parse_number(members),
+        parse_number(ranked),
+        parse_number(popularity),
+        parse_number(favorites),
+        parse_episodes(episodes),
+        aired_from,
+        aired_to,
+        parse_duration(duration),
+    )
+
+
+def export_snapshot(db_path, out_dir):
+    """Write animelist.db's typed columns and genre membership as .npy files. Returns the manifest."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    try:
+        columns = list(SNAPSHOT_COLUMNS)
+        rows = conn.execute(f'SELECT {", ".join(columns)} FROM anime ORDER BY anime_id').fetchall()
+        genres = [name for name, in conn.execute('SELECT genre_name FROM genres ORDER BY genre_id')]
+        genre_ids = [genre_id for genre_id, in conn.execute('SELECT genre_id FROM genres ORDER BY genre_id')]
+        memberships = conn.execute('SELECT anime_id, genre_id FROM anime_genres').fetchall()
+    finally:
+        conn.close()
+
+    count = len(rows)
+    for position, (name, dtype) in enumerate(SNAPSHOT_COLUMNS.items()):
+        values = [row[position] for row in rows]
+        if dtype == 'int64':
+            values = [MISSING_INT if value is None else value for value in values]
+        elif dtype == 'float64':
+            values = [np.nan if value is None else value for value in values]
+        else:
+            values = ['NaT' if value is None else value for value in values]
+        array = np.lib.format.open_memmap(out / f'{name}.npy', mode='w+', dtype=dtype, shape=(count,))
+        array[:] = np.array(values, dtype=dtype)
+        array.flush()
+        del array
+
+    # One bit per (anime, genre): row i, bit j set when anime i has genres[j]
+    row_of = {anime_id: i for i, anime_id in enumerate(row[0] for row in rows)}
+    column_of = {genre_id: j for j, genre_id in enumerate(genre_ids)}
+    members = np.zeros((count, len(genres)), dtype=bool)
+    for anime_id, genre_id in memberships:
+        if anime_id in row_of and genre_id in column_of:
+            members[row_of[anime_id], column_of[genre_id]] = True
+    bitmap = np.packbits(members, axis=1) if len(genres) else np.zeros((count, 0), dtype=np.uint8)
+    np.save(out / 'genre_bitmap.npy', bitmap)
+
+    manifest = {
+        'source': str(db_path),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'rows': count,
+        'columns': SNAPSHOT_COLUMNS,
+        'missing': {'int64': MISSING_INT, 'float64': 'NaN', 'datetime64[D]': 'NaT'},
+        'genres': genres,
+    }
+    with open(out / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+class Snapshot:
+    """Memory-mapped view of a snapshot directory written by export_snapshot."""
+
+    def __init__(self, snapshot_dir):
+        self.dir = Path(snapshot_dir)
+        with open(self.dir / 'manifest.json', 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.genres = self.manifest['genres']
+        self.columns = {name: np.load(self.dir / f'{name}.npy', mmap_mode='r') for name in self.manifest['columns']}
+        self.genre_bitmap = np.load(self.dir / 'genre_bitmap.npy', mmap_mode='r')
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def genre_mask(self, genre):
+        """Boolean array: which anime have `genre`."""
+        j = self.genres.index(genre)
+        return (self.genre_bitmap[:, j // 8] >> (7 - j % 8)) & 1 == 1
+
+    def genre_matrix(self):
+        return np.unpackbits(self.genre_bitmap, axis=1, count=len(self.genres)).astype(bool)
+
+
+def score_episodes_correlation(snapshot):
+    """Pearson correlation of score and episode count over titles that have both."""
+    score, episodes = snapshot['score'], snapshot['episode_count']
+    valid = ~np.isnan(score) & (episodes != MISSING_INT)
+    if valid.sum() < 2:
+        return float('nan')
+    return float(np.corrcoef(score[valid], episodes[valid])[0, 1])
+
+
+def genre_share_of_top(snapshot, top_n=100):
+    """Share of the `top_n` highest scored titles carrying each genre, highest first."""
+    score = np.where(np.isnan(snapshot['score']), -np.inf, snapshot['score'])
+    top = np.argsort(-score, kind='stable')[:top_n]
+    shares = snapshot.genre_matrix()[top].mean(axis=0) if len(top) else np.zeros(len(snapshot.genres))
+    return sorted(zip(snapshot.genres, shares.tolist()), key=lambda pair: -pair[1])
+
+
+def mean_score_by_year(snapshot):
+    """Mean score per premiere year, from aired_from."""
+    years = snapshot['aired_from'].astype('datetime64[Y]').astype('int64') + 1970
+    valid = ~np.isnat(snapshot['aired_from']) & ~np.isnan(snapshot['score'])
+    result = {}
+    for year in np.unique(years[valid]):
+        result[int(year)] = float(snapshot['score'][valid & (years == year)].mean())
+    return result
+
+
+def sql_pandas_baseline(db_path, top_n=100):
+    """The same two analyses straight from the TEXT columns, the way they had to be done before."""
+    import pandas as pd
+
+    conn = sqlite3.connect(db_path)
+    try:
+        anime = pd.read_sql_query('SELECT anime_id, score, episodes FROM anime', conn)
+        genres = pd.read_sql_query('''
+        SELECT ag.anime_id, g.genre_name FROM anime_genres ag JOIN genres g ON g.genre_id = ag.genre_id''', conn)
+    finally:
+        conn.close()
+    anime['episode_count'] = anime['episodes'].map(parse_episodes)
+    valid = anime.dropna(subset=['score', 'episode_count'])
+    correlation = valid['score'].corr(valid['episode_count'].astype(float))
+    top = anime.sort_values('score', ascending=False, kind='stable').head(top_n)
+    shares = genres[genres['anime_id'].isin(top['anime_id'])]['genre_name'].value_counts() / len(top)
+    return correlation, shares
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='write the snapshot from animelist.db')
+    export.add_argument('--db', default='animelist.db')
+    export.add_argument('--out', default='anime_snapshot')
+    report = sub.add_parser('report', help='run the analyses on a snapshot')
+    report.add_argument('--dir', default='anime_snapshot')
+    report.add_argument('--top', type=int, default=100)
+    report.add_argument('--compare-db', help='also time the same analyses with SQL + pandas on this database')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        start = time.perf_counter()
+        manifest = export_snapshot(args.db, args.out)
+        print(f"Wrote {manifest['rows']} anime, {len(manifest['columns'])} columns and "
+              f"{len(manifest['genres'])} genres to {args.out} in {time.perf_counter() - start:.2f}s")
+        return
+
+    start = time.perf_counter()
+    snapshot = Snapshot(args.dir)
+    correlation = score_episodes_correlation(snapshot)
+    shares = genre_share_of_top(snapshot, args.top)
+    by_year = mean_score_by_year(snapshot)
+    snapshot_ms = (time.perf_counter() - start) * 1000
+
+    print(f"Anime in snapshot: {len(snapshot)}")
+    print(f"Score vs episodes correlation: {correlation:.3f}")
+    print(f"\nGenre share of the top {args.top} by score:")
+    for genre, share in shares[:10]:
+        print(f"  {genre:<20}{share:>7.1%}")
+    if by_year:
+        recent = sorted(by_year)[-5:]
+        print("\nMean score, last 5 premiere years: " + ', '.join(f"{y}: {by_year[y]:.2f}" for y in recent))
+    print(f"\nSnapshot analyses: {snapshot_ms:.1f} ms (including opening the memory maps)")
+
+    if args.compare_db:
+        start = time.perf_counter()
+        sql_pandas_baseline(args.compare_db, args.top)
+        baseline_ms = (time.perf_counter() - start) * 1000
+        print(f"SQL + pandas + string parsing (correlation and genre share only): {baseline_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
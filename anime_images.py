@@ -0,0 +1,346 @@
+"""
+Local copies of the anime covers, character pictures and voice-actor portraits
+linked from animelist.db (anime.image_url, characters.image_url, voice_actors.image_url).
+
+    scrapy runspider anime_images.py -a db=animelist.db -a images_dir=images
+    python anime_images.py status --db animelist.db
+    python anime_images.py retry-failed --db animelist.db    # try failed and missing images again
+    python anime_images.py link --db animelist.db            # set image_path again after a reload
+
+Every link is reduced to its canonical CDN URL first (no /r/42x62/ resize prefix, no
+?s= signature, no t/l size suffix on covers), so a portrait that shows up on hundreds
+of anime, in several sizes, is one URL and one download. The image_files table in the
+same database holds each canonical URL with its state:
+
+    pending -> done
+            -> failed    (retried on the next run while attempts < max_attempts)
+            -> missing   (404/410, not retried)
+
+States are committed every few seconds, so a run that is stopped and started again
+only requests what is left. Files are named after the sha256 of their content, two
+directory levels deep (images/ab/cd/abcd....jpg): the same picture under two URLs is
+stored once. At the end of a run the image_path column of anime, characters and
+voice_actors is set to the local file.
+
+Downloads go through Scrapy's HTTP/1.1 connection pool, which keeps connections to
+the CDN open between requests. CONCURRENT_REQUESTS_PER_DOMAIN bounds both the requests
+in flight and the connections kept. Images/s, MB/s and the dedupe counts are logged
+while it runs and at the end, and are in the crawl stats (images/...). To try it
+without network, add the mal_standin.py settings (-s MAL_STANDIN_URL=... -s DOWNLOAD_HANDLERS=...).
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+import scrapy
+
+CDN_HOST = 'cdn.myanimelist.net'
+CDN_HOSTS = {CDN_HOST, 'myanimelist.cdn-dena.com'}
+# /r/42x62/images/... is a resized copy of /images/...
+RESIZED = re.compile(r'^/r/\d+x\d+(?=/images/)')
+# Covers come as 12345.jpg, 12345t.jpg (thumbnail) and 12345l.jpg (large)
+COVER_SIZE = re.compile(r'^(/images/(?:anime|manga)/\d+/\d+)[tl](\.\w+)$')
+EXTENSIONS = {'.jpg': '.jpg', '.jpeg': '.jpg', '.png': '.png', '.gif': '.gif', '.webp': '.webp'}
+CONTENT_TYPES = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp'}
+
+# Tables whose image_url links are fetched, with their key; image_path is added to each
+IMAGE_TABLES = {'anime': 'anime_id', 'characters': 'character_id', 'voice_actors': 'voice_actor_id'}
+STATES = ('pending', 'done', 'failed', 'missing')
+
+
+def canonical_image_url(url):
+    """The full-size URL an image link points at (resized and signed CDN links included), or None."""
+    url = (url or '').strip()
+    if url.startswith('//'):
+        url = 'https:' + url
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    host = parts.netloc.lower()
+    if host not in CDN_HOSTS:
+        return urlunsplit((parts.scheme, host, parts.path, parts.query, ''))
+    path = COVER_SIZE.sub(r'\1\2', RESIZED.sub('', parts.path))
+    return f'https://{CDN_HOST}{path}'
+
+
+def file_extension(url, content_type=None):
+    extension = os.path.splitext(urlsplit(url).path)[1].lower()
+    return EXTENSIONS.get(extension) or CONTENT_TYPES.get(content_type, '.img')
+
+
+class ImageStore:
+    """
+    Download state of every canonical image URL (image_files in the anime database)
+    and the content-addressed files under `images_dir`.
+    """
+
+    def __init__(self, db_path='animelist.db', images_dir='images', max_attempts=3,
+                 checkpoint_every=200, checkpoint_seconds=5.0):
+        self.db_path = db_path
+        self.images_dir = Path(images_dir)
+        self.max_attempts = max_attempts
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        # Autocommit, transactions are opened explicitly; WAL so usedb.py and a crawl can keep going
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_files (
+            url TEXT PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sha256 TEXT,
+            path TEXT,
+            size INTEGER,
+            last_error TEXT,
+            updated REAL
+        )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_image_files_state ON image_files(state)')
+        self.tables = []
+        for table in IMAGE_TABLES:
+            columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+            if not columns:
+                continue  # not loaded yet
+            if 'image_path' not in columns:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN image_path TEXT')
+            self.tables.append(table)
+        self.marks = []  # (state, digest, path, size, error, url) waiting for the next checkpoint
+        self.last_checkpoint = time.monotonic()
+
+    def seed(self):
+        """
+        Queue the canonical URL of every link without a local file yet.
+        Returns (links, distinct canonical URLs among them, newly queued).
+        """
+        links = 0
+        urls = set()
+        for table in self.tables:
+            for url, in self.conn.execute(
+                    f'SELECT image_url FROM {table} WHERE image_url IS NOT NULL AND image_path IS NULL'):
+                canonical = canonical_image_url(url)
+                if canonical is not None:
+                    links += 1
+                    urls.add(canonical)
+        before = self.conn.total_changes
+        now = time.time()
+        self.conn.execute('BEGIN')
+        self.conn.executemany('INSERT OR IGNORE INTO image_files (url, updated) VALUES (?, ?)',
+                              ((url, now) for url in sorted(urls)))
+        self.conn.execute('COMMIT')
+        return links, len(urls), self.conn.total_changes - before
+
+    def pending(self):
+        """URLs to request: never tried, or failed with attempts left."""
+        return [url for url, in self.conn.execute(
+            "SELECT url FROM image_files WHERE state = 'pending' OR (state = 'failed' AND attempts < ?) "
+            "ORDER BY url", (self.max_attempts,))]
+
+    def file_path(self, digest, extension):
+        # Two levels of sharding keep directories small: images/ab/cd/abcd....jpg
+        return self.images_dir / digest[:2] / digest[2:4] / f'{digest}{extension}'
+
+    def store(self, url, body, content_type=None):
+        """Write an image unless the same content is there already. Returns (path, written)."""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.file_path(digest, file_extension(url, content_type))
+        written = not path.exists()
+        if written:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + '.tmp')
+            tmp.write_bytes(body)
+            os.replace(tmp, path)
+        self.marks.append(('done', digest, path.as_posix(), len(body), None, url))
+        return path, written
+
+    def mark_failed(self, url, error, missing=False):
+        self.marks.append(('missing' if missing else 'failed', None, None, None, str(error)[:500], url))
+
+    def due(self):
+        return (len(self.marks) >= self.checkpoint_every
+                or time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds)
+
+    def checkpoint(self):
+        """Commit the states recorded since the last checkpoint, in one transaction."""
+        if self.marks:
+            now = time.time()
+            self.conn.execute('BEGIN')
+            self.conn.executemany('''
+            UPDATE image_files SET state = ?, attempts = attempts + 1, sha256 = COALESCE(?, sha256),
+                path = COALESCE(?, path), size = COALESCE(?, size), last_error = ?, updated = ?
+            WHERE url = ?''', [(state, digest, path, size, error, now, url)
+                               for state, digest, path, size, error, url in self.marks])
+            self.conn.execute('COMMIT')
+            self.marks = []
+        self.last_checkpoint = time.monotonic()
+
+    def link(self):
+        """Set image_path on every row whose image is stored. Returns the rows changed."""
+        paths = dict(self.conn.execute("SELECT url, path FROM image_files WHERE state = 'done'"))
+        changed = 0
+        self.conn.execute('BEGIN')
+        for table in self.tables:
+            key = IMAGE_TABLES[table]
+            rows = self.conn.execute(
+                f'SELECT {key}, image_url, image_path FROM {table} WHERE image_url IS NOT NULL').fetchall()
+            updates = []
+            for row_id, url, current in rows:
+                path = paths.get(canonical_image_url(url))
+                if path is not None and path != current:
+                    updates.append((path, row_id))
+            self.conn.executemany(f'UPDATE {table} SET image_path = ? WHERE {key} = ?', updates)
+            changed += len(updates)
+        self.conn.execute('COMMIT')
+        return changed
+
+    def retry_failed(self):
+        """Give failed and missing images another max_attempts tries. Returns how many."""
+        cursor = self.conn.execute(
+            "UPDATE image_files SET state = 'pending', attempts = 0 WHERE state IN ('failed', 'missing')")
+        return cursor.rowcount
+
+    def counts(self):
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.conn.execute('SELECT state, COUNT(*) FROM image_files GROUP BY state'))
+        return counts
+
+    def stats(self):
+        """Counts per state, plus files and bytes on disk (identical content counted once)."""
+        files, size = self.conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (
+            SELECT sha256, MAX(size) AS size FROM image_files WHERE state = 'done' GROUP BY sha256
+        )''').fetchone()
+        unlinked = sum(self.conn.execute(
+            f'SELECT COUNT(*) FROM {table} WHERE image_url IS NOT NULL AND image_path IS NULL').fetchone()[0]
+            for table in self.tables)
+        return dict(self.counts(), files=files, megabytes=round(size / 1e6, 1), rows_without_image_path=unlinked)
+
+    def close(self):
+        self.checkpoint()
+        self.conn.close()
+
+
+class AnimeImageSpider(scrapy.Spider):
+    name = "anime_images"
+
+    # Everything comes from one CDN host, so the per-domain limit is the number of
+    # requests in flight and of keep-alive connections the pool keeps; override per
+    # run with -s CONCURRENT_REQUESTS_PER_DOMAIN=32
+    custom_settings = {
+        'CONCURRENT_REQUESTS': 32,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+        'DOWNLOAD_DELAY': 0,
+        'DOWNLOAD_MAXSIZE': 20 * 1024 * 1024,
+        'COOKIES_ENABLED': False,
+    }
+
+    REPORT_SECONDS = 30
+
+    def __init__(self, db='animelist.db', images_dir='images', max_attempts=3, *args, **kwargs):
+        """
+        Spider arguments (scrapy runspider anime_images.py -a db=animelist.db ...):
+        db           -- database loaded by animetodb.py; the download states are kept in it too
+        images_dir   -- where the files go; image_path holds paths under it
+        max_attempts -- runs that may try a failing image
+        """
+        super().__init__(*args, **kwargs)
+        self.store = ImageStore(db, images_dir, int(max_attempts))
+        self.counts = {'downloaded': 0, 'bytes': 0, 'duplicate_content': 0, 'failed': 0, 'missing': 0}
+        self.started = time.perf_counter()
+        self.last_report = time.monotonic()
+
+    def start_requests(self):
+        links, urls, added = self.store.seed()
+        pending = self.store.pending()
+        self.crawler.stats.set_value('images/links', links)
+        self.crawler.stats.set_value('images/duplicate_urls', links - urls)
+        logging.info(f"{links} image links without a local file, {urls} distinct images "
+                     f"({links - urls} repeats), {added} new; {len(pending)} to fetch: {self.store.counts()}")
+        self.started = time.perf_counter()
+        # Scrapy takes start requests only as fast as the downloader has room for them
+        for url in pending:
+            yield scrapy.Request(url, callback=self.save_image, errback=self.handle_failure,
+                                 meta={'image_url': url, 'handle_httpstatus_all': True}, dont_filter=True)
+
+    def save_image(self, response):
+        url = response.meta['image_url']
+        content_type = response.headers.get('Content-Type', b'').decode('latin-1').split(';')[0].strip().lower()
+        if response.status in (404, 410):
+            self.fail(url, f'HTTP {response.status}', missing=True)
+        elif response.status != 200 or not response.body or (content_type and not content_type.startswith('image/')):
+            self.fail(url, f'HTTP {response.status} {content_type}'.strip())
+        else:
+            _, written = self.store.store(url, response.body, content_type)
+            self.count('downloaded')
+            self.count('bytes', len(response.body))
+            if not written:
+                self.count('duplicate_content')
+        self.progress()
+
+    def handle_failure(self, failure):
+        url = failure.request.meta['image_url']
+        logging.error(f"Error fetching {url}: {failure.value}")
+        self.fail(url, failure.value)
+        self.progress()
+
+    def fail(self, url, error, missing=False):
+        self.store.mark_failed(url, error, missing)
+        self.count('missing' if missing else 'failed')
+
+    def count(self, what, n=1):
+        self.counts[what] += n
+        self.crawler.stats.inc_value(f'images/{what}', n)
+
+    def progress(self):
+        if self.store.due():
+            self.store.checkpoint()
+        if time.monotonic() - self.last_report >= self.REPORT_SECONDS:
+            self.last_report = time.monotonic()
+            logging.info(self.throughput())
+
+    def throughput(self):
+        seconds = time.perf_counter() - self.started
+        rate = self.counts['downloaded'] / seconds if seconds else 0.0
+        megabytes = self.counts['bytes'] / 1e6
+        self.crawler.stats.set_value('images/images_per_second', round(rate, 2))
+        self.crawler.stats.set_value('images/mb_per_second', round(megabytes / seconds, 3) if seconds else 0.0)
+        return (f"Images: {self.counts['downloaded']} downloaded ({megabytes:.1f} MB) in {seconds:.1f}s, "
+                f"{rate:.1f} images/s, {megabytes / seconds if seconds else 0.0:.2f} MB/s; "
+                f"{self.counts['duplicate_content']} duplicate content, {self.counts['failed']} failed, "
+                f"{self.counts['missing']} missing")
+
+    def closed(self, reason):
+        self.store.checkpoint()
+        linked = self.store.link()
+        logging.info(self.throughput())
+        logging.info(f"image_path set on {linked} rows; {self.store.db_path} now has {self.store.stats()}")
+        self.store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect the image downloads recorded in the anime database')
+    parser.add_argument('command', choices=['status', 'retry-failed', 'link'])
+    parser.add_argument('--db', default='animelist.db')
+    args = parser.parse_args()
+
+    store = ImageStore(args.db)
+    try:
+        if args.command == 'status':
+            for key, value in store.stats().items():
+                print(f"{key}: {value}")
+        elif args.command == 'retry-failed':
+            print(f"{store.retry_failed()} images requeued")
+        else:
+            print(f"image_path set on {store.link()} rows")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
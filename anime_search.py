@@ -0,0 +1,480 @@
+"""
+Title and full-text search over animelist.db.
+
+usedb.py could only find an anime by its exact title (WHERE a.title = ?). The loader
+now keeps two search structures next to the anime table:
+
+    anime_search          FTS5 index, one document per anime (rowid = anime_id) over
+                          title, english_title, japanese_title, synonyms and the
+                          description paragraphs; ranked with bm25, titles weighted
+                          above synonyms above description text
+    anime_title_names     every name of an anime (title, English, Japanese, each synonym)
+                          normalized, in an FTS5 table with the trigram tokenizer: the
+                          typo-tolerant lookup. anime_title_grams counts the names per
+                          trigram, so a query only reads the posting lists of its rarest
+                          trigrams; the names sharing most of them are scored by Dice
+                          similarity and edit similarity
+
+search() runs the FTS5 query first and fills up with fuzzy title matches, so
+"frieren", "sousou no fri" and "Sosou no Freiren" all find Sousou no Frieren.
+
+    python anime_search.py query "sosou no freiren" --db animelist.db
+    python anime_search.py rebuild --db animelist.db      # index a database loaded before this existed
+    python anime_search.py bench --rows 100000             # search latency on synthetic data
+
+The loader (animetodb.py) indexes every chunk it writes; this file has to be next to it.
+"""
+import argparse
+import collections
+import contextlib
+import difflib
+import io
+import json
+import random
+import re
+import sqlite3
+import statistics
+import time
+import unicodedata
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+SEARCH_TABLES = {
+    'anime_search': '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS anime_search USING fts5(
+            title, english_title, japanese_title, synonyms, description,
+            tokenize = 'unicode61 remove_diacritics 2')''',
+    # rowid = anime_id * NAMES_PER_ANIME + n, so an anime's names are one rowid range
+    'anime_title_names': '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS anime_title_names USING fts5(
+            padded, name UNINDEXED, tokenize = 'trigram')''',
+    'anime_title_grams': '''
+        CREATE TABLE IF NOT EXISTS anime_title_grams (
+            gram TEXT PRIMARY KEY,
+            names INTEGER NOT NULL
+        ) WITHOUT ROWID''',
+}
+
+# bm25 weights in anime_search column order
+COLUMN_WEIGHTS = (10.0, 8.0, 8.0, 5.0, 1.0)
+TITLE_COLUMNS = '{title english_title japanese_title synonyms}'
+
+# Fuzzy lookup: names need this Dice similarity on trigrams to be a match, and at most
+# this many candidates are scored per query. One typo changes at most 3 trigrams, so a name
+# within MAX_TYPOS typos of the query has at least one of its 3 * MAX_TYPOS + 1 rarest trigrams.
+MIN_SIMILARITY = 0.4
+MAX_CANDIDATES = 100
+MAX_TYPOS = 3
+NAMES_PER_ANIME = 16
+
+# best_match wants one anime, not a list to pick from. Sequels are only a few characters
+# apart ("Part II" / "Part III"), so callers should still say when the match is not exact
+BEST_MATCH_SIMILARITY = 0.85
+
+
+def normalize(text):
+    """Lower case, no accents, punctuation as spaces: 'Sōsō no Frieren!' -> 'soso no frieren'."""
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.casefold()
+    return ' '.join(re.sub(r'[\W_]+', ' ', text).split())
+
+
+def padded(normalized):
+    """A normalized name as stored in anime_title_names, padded so the first and last letters get trigrams too."""
+    return f'  {normalized} '
+
+
+def trigrams(normalized):
+    """The trigrams the FTS5 trigram tokenizer makes of padded(normalized)."""
+    text = padded(normalized)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def split_synonyms(synonyms):
+    """The synonyms column holds MAL's comma-separated list."""
+    return [name.strip() for name in (synonyms or '').split(', ') if name.strip()]
+
+
+def create_search_tables(cursor):
+    """Create the search tables if needed. Returns True when they did not exist yet."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE name = 'anime_search'")
+    is_new = cursor.fetchone() is None
+    for sql in SEARCH_TABLES.values():
+        cursor.execute(sql)
+    return is_new
+
+
+def index_anime(cursor, rows, replace=False):
+    """
+    Add anime to both indexes. `rows` are (anime_id, title, japanese_title, english_title,
+    synonyms, description). With replace=True whatever was indexed for those ids before
+    is removed first; the loader always writes new ids and skips that.
+    """
+    rows = list(rows)
+    if replace:
+        remove_anime(cursor, [row[0] for row in rows])
+    cursor.executemany('''
+    INSERT INTO anime_search (rowid, title, english_title, japanese_title, synonyms, description)
+    VALUES (?, ?, ?, ?, ?, ?)''', [(anime_id, title, english, japanese, synonyms, description)
+                                   for anime_id, title, japanese, english, synonyms, description in rows])
+
+    names = []
+    for anime_id, title, japanese, english, synonyms, _ in rows:
+        seen = []
+        for name in [title, english, japanese] + split_synonyms(synonyms):
+            normalized = normalize(name)
+            if normalized and normalized not in seen and len(seen) < NAMES_PER_ANIME:
+                names.append((anime_id * NAMES_PER_ANIME + len(seen), padded(normalized), name))
+                seen.append(normalized)
+    cursor.executemany('INSERT INTO anime_title_names (rowid, padded, name) VALUES (?, ?, ?)', names)
+    count_grams(cursor, [name_padded for _, name_padded, _ in names], 1)
+    return len(rows)
+
+
+def count_grams(cursor, names, sign):
+    """Add (sign=1) or take away (sign=-1) the trigrams of these padded names in anime_title_grams."""
+    counts = collections.Counter()
+    for name_padded in names:
+        counts.update(trigrams(name_padded.strip()))
+    cursor.executemany('''
+    INSERT INTO anime_title_grams (gram, names) VALUES (?, ?)
+    ON CONFLICT (gram) DO UPDATE SET names = names + excluded.names''',
+                       [(gram, sign * count) for gram, count in counts.items()])
+
+
+def remove_anime(cursor, anime_ids):
+    """Take anime out of both indexes."""
+    anime_ids = list(anime_ids)
+    ranges = [(anime_id * NAMES_PER_ANIME, (anime_id + 1) * NAMES_PER_ANIME - 1) for anime_id in anime_ids]
+    names = []
+    for first, last in ranges:
+        names += [name_padded for name_padded, in cursor.execute(
+            'SELECT padded FROM anime_title_names WHERE rowid BETWEEN ? AND ?', (first, last)).fetchall()]
+    count_grams(cursor, names, -1)
+    cursor.executemany('DELETE FROM anime_search WHERE rowid = ?', [(anime_id,) for anime_id in anime_ids])
+    cursor.executemany('DELETE FROM anime_title_names WHERE rowid BETWEEN ? AND ?', ranges)
+
+
+def clear_index(cursor):
+    cursor.execute('DELETE FROM anime_search')
+    cursor.execute('DELETE FROM anime_title_names')
+    cursor.execute('DELETE FROM anime_title_grams')
+
+
+def optimize_index(cursor):
+    """Merge the FTS5 segments written chunk by chunk into one; worth it after a full load."""
+    cursor.execute("INSERT INTO anime_search (anime_search) VALUES ('optimize')")
+    cursor.execute("INSERT INTO anime_title_names (anime_title_names) VALUES ('optimize')")
+
+
+def rebuild_index(conn, chunk_size=5000):
+    """Index every anime in the database from scratch. Returns the number indexed."""
+    cursor = conn.cursor()
+    create_search_tables(cursor)
+    clear_index(cursor)
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(anime)')}
+    synonyms = 'a.synonyms' if 'synonyms' in columns else 'NULL'
+    rows = conn.execute(f'''
+    SELECT a.anime_id, a.title, a.japanese_title, a.english_title, {synonyms},
+           (SELECT group_concat(description_text, char(10)) FROM (
+                SELECT description_text FROM descriptions d
+                WHERE d.anime_id = a.anime_id ORDER BY d.description_id))
+    FROM anime a ORDER BY a.anime_id''')
+    indexed = 0
+    while True:
+        chunk = rows.fetchmany(chunk_size)
+        if not chunk:
+            break
+        indexed += index_anime(cursor, chunk)
+    optimize_index(cursor)
+    conn.commit()
+    return indexed
+
+
+def fts_query(text, prefix=True):
+    """
+    FTS5 MATCH expression for free text: every word quoted (so user input cannot be
+    FTS5 syntax), all of them required, the last one as a prefix while the user is typing.
+    """
+    words = normalize(text).split()
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def text_search(conn, text, limit=10, titles_only=False, prefix=True):
+    """bm25-ranked FTS5 matches: dicts with anime_id, title, score (higher is better) and snippet."""
+    match = fts_query(text, prefix)
+    if match is None:
+        return []
+    if titles_only:
+        match = f'{TITLE_COLUMNS} : ({match})'
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    rows = conn.execute(f'''
+    SELECT rowid, title, -bm25(anime_search, {weights}) AS score,
+           snippet(anime_search, 4, '[', ']', '...', 12)
+    FROM anime_search
+    WHERE anime_search MATCH ?
+    ORDER BY bm25(anime_search, {weights})
+    LIMIT ?''', (match, limit))
+    return [{'anime_id': anime_id, 'title': title, 'score': round(score, 3), 'match': 'text', 'snippet': snippet}
+            for anime_id, title, score, snippet in rows]
+
+
+def fuzzy_search(conn, text, limit=10, min_similarity=MIN_SIMILARITY):
+    """
+    Typo-tolerant title lookup: names scored by trigram Dice similarity and edit similarity
+    to the query, at least min_similarity Dice. One result per anime, with the name that matched.
+    """
+    normalized = normalize(text)
+    grams = trigrams(normalized) if normalized else set()
+    if not grams:
+        return []
+    # Only the posting lists of the rarest trigrams are read: the common ones
+    # (' no', 'ion', ...) would be most of the work and say little about the name
+    counts = dict(conn.execute(f'''
+    SELECT gram, names FROM anime_title_grams
+    WHERE gram IN ({', '.join('?' * len(grams))}) AND names > 0''', list(grams)))
+    rare = sorted(counts, key=counts.get)[:3 * MAX_TYPOS + 1]
+    if not rare:
+        return []
+    postings = ' UNION ALL '.join(['SELECT rowid FROM anime_title_names WHERE anime_title_names MATCH ?'] * len(rare))
+    candidates = [rowid for rowid, in conn.execute(f'''
+    SELECT rowid FROM ({postings}) GROUP BY rowid ORDER BY COUNT(*) DESC LIMIT ?''',
+                                                   [f'"{gram}"' for gram in rare] + [MAX_CANDIDATES])]
+
+    best = {}
+    for rowid, name_padded, name in conn.execute(f'''
+    SELECT rowid, padded, name FROM anime_title_names WHERE rowid IN ({', '.join('?' * len(candidates))})''',
+                                                 candidates):
+        name_normalized = name_padded.strip()
+        name_grams = trigrams(name_normalized)
+        dice = 2 * len(grams & name_grams) / (len(grams) + len(name_grams))
+        if dice < min_similarity:
+            continue
+        ratio = difflib.SequenceMatcher(None, normalized, name_normalized).ratio()
+        score = round((ratio + dice) / 2, 3)
+        anime_id = rowid // NAMES_PER_ANIME
+        if anime_id not in best or score > best[anime_id][0]:
+            best[anime_id] = (score, name)
+    if not best:
+        return []
+    ranked = sorted(best.items(), key=lambda entry: -entry[1][0])[:limit]
+    titles = dict(conn.execute(f'''
+    SELECT anime_id, title FROM anime WHERE anime_id IN ({', '.join('?' * len(ranked))})''',
+                               [anime_id for anime_id, _ in ranked]))
+    return [{'anime_id': anime_id, 'title': titles.get(anime_id, name), 'score': score,
+             'match': 'fuzzy', 'matched_name': name}
+            for anime_id, (score, name) in ranked]
+
+
+def search(conn, text, limit=10, titles_only=False):
+    """
+    Ranked search: exact title matches first, then FTS5 matches (bm25), then fuzzy
+    title matches for whatever is left of `limit`. Each anime appears once.
+    """
+    results = [{'anime_id': anime_id, 'title': title, 'score': None, 'match': 'exact'}
+               for anime_id, title in conn.execute(
+                   'SELECT anime_id, title FROM anime WHERE title = ? LIMIT ?', (text, limit))]
+    seen = {result['anime_id'] for result in results}
+    for finder in (text_search, fuzzy_search):
+        if len(results) >= limit:
+            break
+        kwargs = {'titles_only': titles_only} if finder is text_search else {}
+        for result in finder(conn, text, limit, **kwargs):
+            if result['anime_id'] not in seen and len(results) < limit:
+                seen.add(result['anime_id'])
+                results.append(result)
+    return results
+
+
+def best_match(conn, text, min_similarity=BEST_MATCH_SIMILARITY):
+    """
+    The anime a title as a user typed it names, as a search() result ('match' is 'exact'
+    or 'fuzzy'), or None. Only the exact title or a title/synonym within a few typos;
+    prefix, full-text and loose fuzzy matches are for browsing with search().
+    """
+    row = conn.execute('SELECT anime_id, title FROM anime WHERE title = ? LIMIT 1', (text,)).fetchone()
+    if row is not None:
+        return {'anime_id': row[0], 'title': row[1], 'score': None, 'match': 'exact'}
+    results = fuzzy_search(conn, text, 1, min_similarity)
+    return results[0] if results else None
+
+
+def misspell(text, rng, edits=2):
+    """`text` with a few random letter swaps, drops and substitutions: what a user might type."""
+    chars = list(text)
+    for _ in range(edits):
+        positions = [i for i, ch in enumerate(chars) if ch.isalpha()]
+        if len(positions) < 4:
+            break
+        i = rng.choice(positions[1:-1])
+        action = rng.choice(('swap', 'drop', 'replace'))
+        if action == 'swap' and i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        elif action == 'drop':
+            del chars[i]
+        else:
+            chars[i] = rng.choice('aeiounrstk')
+    return ''.join(chars)
+
+
+def bench_items(rows, seed=42):
+    """
+    Synthetic loader items with varied names: words of the real titles in animedata.json
+    recombined, so the trigram index sees realistic overlap instead of 'Synthetic Anime N'.
+    """
+    from repo_scripts import load_script
+    animetodb = load_script('animetodb', 'animetodb.py', 'Load Data to DataBase')
+    try:
+        with open(HERE / 'animedata.json', 'r', encoding='utf-8') as f:
+            real_titles = [entry['title'] for entry in json.load(f)]
+    except FileNotFoundError:
+        real_titles = ['Sousou no Frieren', 'Fullmetal Alchemist: Brotherhood', 'Steins;Gate']
+    words = sorted({word for title in real_titles for word in title.split() if len(word) > 2})
+    rng = random.Random(seed)
+    for i, item in enumerate(animetodb.iter_synthetic_items(rows, seed)):
+        if i < len(real_titles):
+            title = real_titles[i]
+        else:
+            title = ' '.join(rng.sample(words, rng.randint(2, 5)))
+        item['title'] = f'{title} ({i + 1})' if i >= len(real_titles) else title
+        item['english_title'] = [f'{title}: English Edition']
+        item['japanese_title'] = [f'{title} (Japanese)']
+        item['synonyms'] = [f'{" ".join(rng.sample(words, 2))}, {title.split()[0]} {i + 1}']
+        yield item
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max_ms': timings[-1],
+    }
+
+
+def bench(db_path, rows, queries, seed, out):
+    """Load `rows` synthetic anime through the loader, then time each kind of lookup."""
+    from repo_scripts import load_script
+    animetodb = load_script('animetodb', 'animetodb.py', 'Load Data to DataBase')
+    db_path = Path(db_path)
+    if db_path.exists():
+        db_path.unlink()
+    db = animetodb.AnimeDatabase(str(db_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = db.load_items(bench_items(rows, seed), chunk_size=2000)
+    conn = db.conn
+    size = db_path.stat().st_size
+    index_seconds = report.seconds.get('(search)', 0.0)
+    print(f"{rows:,} anime loaded in {report.total_seconds:.1f}s, of which search indexing "
+          f"{index_seconds:.1f}s; database {size / 1024 / 1024:.1f} MB")
+
+    rng = random.Random(seed)
+    sample = conn.execute('''
+    SELECT a.anime_id, a.title, d.description_text FROM anime a
+    JOIN descriptions d ON d.anime_id = a.anime_id
+    WHERE a.anime_id IN (SELECT anime_id FROM anime ORDER BY random() LIMIT ?)
+    GROUP BY a.anime_id''', (queries,)).fetchall()
+
+    def word_of(title):
+        words = [w for w in normalize(title).split() if len(w) > 3 and not w.isdigit()]
+        return rng.choice(words) if words else normalize(title).split()[0]
+
+    cases = {
+        # What usedb.py could do before: exact title, or a LIKE scan for anything else
+        'exact title (=)': lambda anime_id, title, desc: conn.execute(
+            'SELECT anime_id FROM anime WHERE title = ?', (title,)).fetchall(),
+        'LIKE %word% scan': lambda anime_id, title, desc: conn.execute(
+            "SELECT anime_id FROM anime WHERE title LIKE ? OR english_title LIKE ? LIMIT 10",
+            (f'%{word_of(title)}%',) * 2).fetchall(),
+        'fts word': lambda anime_id, title, desc: text_search(conn, word_of(title)),
+        'fts title prefix': lambda anime_id, title, desc: text_search(conn, title[:max(4, len(title) * 2 // 3)]),
+        'fts description': lambda anime_id, title, desc: text_search(conn, ' '.join(desc.split()[-3:]), prefix=False),
+        'fuzzy (2 typos)': lambda anime_id, title, desc: fuzzy_search(conn, misspell(title, rng)),
+        'search() (2 typos)': lambda anime_id, title, desc: search(conn, misspell(title, rng)),
+    }
+    # Cases where the anime the query was made from should come back in the top 10
+    recall_cases = {'fts title prefix', 'fts description', 'fuzzy (2 typos)', 'search() (2 typos)'}
+
+    results = {'rows': rows, 'queries': len(sample), 'size_bytes': size,
+               'load_seconds': report.total_seconds, 'index_seconds': index_seconds, 'cases': {}}
+    print(f"\n{len(sample)} queries per kind")
+    print(f"{'lookup':<22}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'found':>8}")
+    for name, run in cases.items():
+        timings, found = [], 0
+        for anime_id, title, desc in sample:
+            start = time.perf_counter()
+            hits = run(anime_id, title, desc)
+            timings.append((time.perf_counter() - start) * 1000)
+            ids = [hit['anime_id'] if isinstance(hit, dict) else hit[0] for hit in hits]
+            found += anime_id in ids
+        case = percentiles(timings)
+        case['found'] = found / len(sample) if name in recall_cases else None
+        results['cases'][name] = case
+        recall = f"{case['found']:.0%}" if case['found'] is not None else '-'
+        print(f"{name:<22}{case['p50_ms']:>9.2f}{case['p95_ms']:>9.2f}{case['max_ms']:>9.2f}{recall:>8}")
+    conn.close()
+    if out:
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWritten to {out}")
+    return results
+
+
+def print_results(results):
+    print(f"{'#':>3}  {'match':<6}{'score':>8}  title")
+    for i, result in enumerate(results, 1):
+        score = '' if result['score'] is None else f"{result['score']:.3f}"
+        extra = result.get('matched_name') or ''
+        if '[' in (result.get('snippet') or ''):  # the description matched too
+            extra = ' '.join(result['snippet'].split())
+        line = f"{i:>3}  {result['match']:<6}{score:>8}  {result['title']}"
+        if extra and extra != result['title']:
+            line += f"   ({extra[:70]})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    query = sub.add_parser('query', help='search the database')
+    query.add_argument('text')
+    query.add_argument('--db', default='animelist.db')
+    query.add_argument('--limit', type=int, default=10)
+    query.add_argument('--titles-only', action='store_true', help='ignore description text')
+    query.add_argument('--fuzzy', action='store_true', help='typo-tolerant title lookup only')
+    rebuild = sub.add_parser('rebuild', help='index every anime in the database again')
+    rebuild.add_argument('--db', default='animelist.db')
+    bench_parser = sub.add_parser('bench', help='search latency on a synthetic database')
+    bench_parser.add_argument('--rows', type=int, default=100000)
+    bench_parser.add_argument('--queries', type=int, default=200, help='queries per kind of lookup')
+    bench_parser.add_argument('--db', default='search_bench.db', help='synthetic database (overwritten)')
+    bench_parser.add_argument('--seed', type=int, default=42)
+    bench_parser.add_argument('--out', help='also write the latencies to this JSON file')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        bench(args.db, args.rows, args.queries, args.seed, args.out)
+        return
+    conn = sqlite3.connect(args.db)
+    if args.command == 'rebuild':
+        start = time.perf_counter()
+        indexed = rebuild_index(conn)
+        print(f"Indexed {indexed} anime in {time.perf_counter() - start:.1f}s")
+    elif args.fuzzy:
+        print_results(fuzzy_search(conn, args.text, args.limit))
+    else:
+        print_results(search(conn, args.text, args.limit, args.titles_only))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Offline end-to-end benchmark: both spiders, the loader and the usedb.py reports
+against the local MyAnimeList stand-in (mal_standin.py), no network needed.
+
+    python bench_e2e.py --pages 1000 --out e2e.json
+    python bench_e2e.py --pages 1000 --latency 0.05 --error-rate 0.02
+    python bench_e2e.py --pages 1000 --compare e2e.json         # exit code 1 on a regression
+
+Stages, each in its own process and working directory:
+
+    anime    scrapy runspider anime.py, the ranking pages and every detail page -> anime.jsonl
+    detail   scrapy runspider detail_data.py -a mode=concurrent over the same URLs -> details.jsonl
+    load     animetodb.py anime.jsonl -> animelist.db
+    queries  usedb.py, every report into anime_query/
+
+For every stage: seconds, pages served by the stand-in (and 503s it injected),
+pages/s, items, items/s and the peak RSS of the stage's process (from wait4, so
+not on Windows). Results go to --out as JSON; --compare lists stages that got
+slower or bigger than --threshold times the old run and exits with 1, for CI. A
+run with other settings (pages, latency, error rate...) is not compared: exit code 2.
+
+Pages come from mal_pages.py (animedata.json rows, synthetic ones past its end),
+or from a page cache recorded by a real crawl with --recorded DIR. Scripts with a
+note above a dashed line (detail_data.py, "Load Data to DataBase", usedb.py) are
+run from a copy of the code below that line.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mal_standin import StandInSite, load_entries, make_server, standin_settings
+from repo_scripts import script_code
+
+HERE = Path(__file__).resolve().parent
+STAGES = ('anime', 'detail', 'load', 'queries')
+
+# Script name in the work directory -> files it can come from, first one found wins
+SCRIPTS = {
+    'anime.py': ('anime.py',),
+    'detail_data.py': ('detail_data.py',),
+    'animetodb.py': ('animetodb.py', 'Load Data to DataBase'),
+    'usedb.py': ('usedb.py',),
+}
+
+
+def prepare_scripts(work_dir):
+    """Runnable copies of the repo scripts in work_dir (it goes first on the workers' path)."""
+    for name, candidates in SCRIPTS.items():
+        for candidate in candidates:
+            path = HERE / candidate
+            if path.exists():
+                (work_dir / name).write_text(script_code(path), encoding='utf-8')
+                break
+        else:
+            raise FileNotFoundError(f"Cannot find {name} (looked for {', '.join(candidates)})")
+
+
+def stage_commands(args, work_dir, server_url):
+    settings = dict(standin_settings(server_url), LOG_LEVEL='INFO')
+    throttle = {
+        'ADAPTIVE_THROTTLE_START_DELAY': args.throttle_start,
+        'ADAPTIVE_THROTTLE_MIN_DELAY': args.throttle_min,
+    }
+
+    def scrapy(script, spider_args, output, extra):
+        command = [sys.executable, '-m', 'scrapy', 'runspider', str(work_dir / script), '-o', output]
+        for name, value in spider_args.items():
+            command += ['-a', f'{name}={value}']
+        for name, value in dict(settings, **extra).items():
+            command += ['-s', f'{name}={json.dumps(value) if isinstance(value, (dict, list)) else value}']
+        return command
+
+    last_limit = max(0, (args.pages - 1) // 50 * 50)
+    return {
+        'anime': scrapy('anime.py', {'last_limit': last_limit}, 'anime.jsonl', throttle),
+        'detail': scrapy('detail_data.py', {'data': 'standin_data.json', 'mode': 'concurrent',
+                                            'window': args.window}, 'details.jsonl', {}),
+        'load': [sys.executable, str(work_dir / 'animetodb.py'), 'anime.jsonl', '--db', 'animelist.db'],
+        'queries': [sys.executable, str(work_dir / 'usedb.py')],
+    }
+
+
+def run_stage(command, work_dir, log_path):
+    """Run one stage to completion. Returns (exit code, seconds, peak RSS in MB or None)."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (str(work_dir), str(HERE), env.get('PYTHONPATH')) if p)
+    with open(log_path, 'wb') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            seconds = time.perf_counter() - start
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in KB on Linux, bytes on macOS
+            rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            process.wait()
+            seconds = time.perf_counter() - start
+            rss = None
+    return process.returncode, seconds, rss
+
+
+def count_lines(path):
+    try:
+        with open(path, 'rb') as f:
+            return sum(1 for line in f if line.strip())
+    except FileNotFoundError:
+        return 0
+
+
+def stage_items(stage, work_dir):
+    """Items a stage produced: output lines for the spiders, anime rows for the loader."""
+    if stage == 'anime':
+        return count_lines(work_dir / 'anime.jsonl')
+    if stage == 'detail':
+        return count_lines(work_dir / 'details.jsonl')
+    if stage == 'load':
+        import sqlite3
+        conn = sqlite3.connect(work_dir / 'animelist.db')
+        try:
+            return conn.execute('SELECT COUNT(*) FROM anime').fetchone()[0]
+        finally:
+            conn.close()
+    return len(list((work_dir / 'anime_query').glob('*.csv')))
+
+
+def run(args, work_dir):
+    prepare_scripts(work_dir)
+    entries = load_entries(args.data)
+    site = StandInSite(entries, page_count=args.pages, latency=args.latency, error_rate=args.error_rate,
+                       recorded=args.recorded, seed=args.seed)
+    with open(work_dir / 'standin_data.json', 'w', encoding='utf-8') as f:
+        json.dump(site.entries, f)
+    server = make_server(site)
+    commands = stage_commands(args, work_dir, server.url)
+
+    results = {}
+    failed = None
+    try:
+        for stage in args.stages:
+            before = dict(site.counters)
+            code, seconds, rss = run_stage(commands[stage], work_dir, work_dir / f'{stage}.log')
+            pages = site.counters['ok'] - before['ok']
+            items = stage_items(stage, work_dir)
+            results[stage] = {
+                'seconds': seconds,
+                'pages': pages,
+                'errors_injected': site.counters['errors'] - before['errors'],
+                'pages_per_second': pages / seconds if seconds else 0.0,
+                'items': items,
+                'items_per_second': items / seconds if seconds else 0.0,
+                'peak_rss_mb': rss,
+                'exit_code': code,
+            }
+            print_stage(stage, results[stage])
+            if code != 0:
+                failed = stage
+                break
+    finally:
+        server.shutdown()
+
+    total = sum(result['seconds'] for result in results.values())
+    report = {
+        'config': {name: getattr(args, name) for name in
+                   ('pages', 'latency', 'error_rate', 'window', 'throttle_start', 'throttle_min', 'recorded')},
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'stages': results,
+        'total_seconds': total,
+        'peak_rss_mb': max((r['peak_rss_mb'] or 0 for r in results.values()), default=0),
+        'failed_stage': failed,
+    }
+    print(f"{'total':<9}{total:>9.1f}{'':>34}{report['peak_rss_mb']:>10.0f}")
+    if failed:
+        log = work_dir / f'{failed}.log'
+        tail = log.read_text(encoding='utf-8', errors='replace').splitlines()[-20:]
+        print(f"\nStage '{failed}' exited with {results[failed]['exit_code']}, last lines of {log}:")
+        print('\n'.join(tail))
+    return report
+
+
+def print_header():
+    print(f"{'stage':<9}{'seconds':>9}{'pages':>8}{'pages/s':>9}{'items':>8}{'items/s':>9}{'peak MB':>10}{'503s':>7}")
+
+
+def print_stage(stage, result):
+    rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+    print(f"{stage:<9}{result['seconds']:>9.1f}{result['pages']:>8}{result['pages_per_second']:>9.1f}"
+          f"{result['items']:>8}{result['items_per_second']:>9.1f}{rss:>10}{result['errors_injected']:>7}")
+
+
+def config_differences(previous, current):
+    """Settings that differ between two runs, as 'name: old -> new' lines."""
+    old, new = previous.get('config', {}), current['config']
+    return [f"{name}: {old.get(name)} -> {new.get(name)}"
+            for name in sorted(set(old) | set(new)) if old.get(name) != new.get(name)]
+
+
+def compare(previous, current, threshold):
+    """Print stages that got slower or bigger than `threshold` times. Returns the count."""
+    problems = 0
+    for stage, result in current['stages'].items():
+        before = previous['stages'].get(stage)
+        if before is None:
+            continue
+        checks = [('seconds', result['seconds'], before['seconds'], 0.5),
+                  ('peak RSS MB', result['peak_rss_mb'], before['peak_rss_mb'], 10)]
+        for what, now, then, noise in checks:
+            # Ignore differences smaller than the run-to-run noise
+            if now is None or not then or now - then <= noise:
+                continue
+            if now / then >= threshold:
+                problems += 1
+                print(f"- {stage}: {what} {then:.1f} -> {now:.1f} ({now / then:.2f}x)")
+        if result['items'] != before['items']:
+            problems += 1
+            print(f"- {stage}: {before['items']} items before, {result['items']} now")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=500, help='anime the stand-in serves (detail pages)')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in response latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--recorded', metavar='DIR', help='serve pages from this page cache where it has them')
+    parser.add_argument('--data', default=str(HERE / 'animedata.json'), help='rows the pages are built from')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--window', type=int, default=32, help='detail spider pages in flight')
+    parser.add_argument('--throttle-start', type=float, default=0.05,
+                        help="anime spider's first delay (it is 2s against the real site)")
+    parser.add_argument('--throttle-min', type=float, default=0.01, help="anime spider's shortest delay")
+    parser.add_argument('--seed', type=int, default=0, help='which requests get the injected 503s')
+    parser.add_argument('--work-dir', help='keep outputs, logs and the database here (default: a temp dir)')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='OLD_JSON', help='flag stages that regressed against this run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown / growth that counts as a regression')
+    args = parser.parse_args()
+
+    print(f"{args.pages} pages, latency {args.latency}s, error rate {args.error_rate:.0%}, "
+          f"{os.cpu_count()} CPUs, Python {platform.python_version()}\n")
+    print_header()
+    if args.work_dir:
+        work_dir = Path(args.work_dir).resolve()
+        work_dir.mkdir(parents=True, exist_ok=True)
+        report = run(args, work_dir)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            report = run(args, Path(tmp))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    status = 1 if report['failed_stage'] else 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        differences = config_differences(previous, report)
+        if differences:
+            # Timings of runs with other pages/latency/error rate say nothing about a regression
+            print(f"\nNot compared with {args.compare}, it was run with other settings:")
+            print('\n'.join(f"- {line}" for line in differences))
+            sys.exit(2)
+        print(f"\nCompared with {args.compare} (threshold {args.threshold}x):")
+        problems = compare(previous, report, args.threshold)
+        print(f"{problems} regressions" if problems else "no regressions")
+        status = status or (1 if problems else 0)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Load benchmark for "Load Data to DataBase" (animetodb.py).
+
+Loads N synthetic titles twice, once with the row-by-row insert the loader used
+before load_items (kept here as the baseline) and once with load_items, and
+prints rows/s per table and the speedup.
+
+    python bench_load.py 4400
+    python bench_load.py 20000 --chunk-size 5000
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from repo_scripts import load_script
+
+
+def legacy_insert_anime_data(db, data: List[Dict]):
+    """The row-by-row insert this loader used before load_items, kept as the benchmark baseline."""
+    successful_inserts = 0
+    failed_inserts = 0
+    duplicates = 0
+    
+    # Keep track of titles we've seen to avoid duplicates
+    seen_titles = set()
+    
+    for idx, item in enumerate(data):
+        try:
+            # Validate that item is a dictionary
+            if not isinstance(item, dict):
+                print(f"Skipping invalid item at index {idx}: not a dictionary")
+                failed_inserts += 1
+                continue
+
+            # Get title and check for duplicate
+            title = item.get('title')
+            if not title:  # Skip items with no title
+                print(f"Skipping item {idx}: No title found")
+                failed_inserts += 1
+                continue
+            
+            if title in seen_titles:
+                print(f"Skipping duplicate title: {title}")
+                duplicates += 1
+                continue
+            
+            seen_titles.add(title)
+
+            print(f"Processing item {idx + 1}/{len(data)}: {title}")
+            
+            # Insert anime with safer data access
+            db.cursor.execute('''
+            INSERT INTO anime (title, japanese_title, english_title, type, episodes,
+                             status, aired, premiered, broadcast, source, duration,
+                             rating, score, ranked, popularity, members, favorites,
+                             image_url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                title,  # Use the title we already validated
+                item.get('japanese_title', [None])[0] if item.get('japanese_title') else None,
+                item.get('english_title', [None])[0] if item.get('english_title') else None,
+                item.get('anime_type', item.get('type', None)),
+                item.get('episodes', [None])[0] if item.get('episodes') else None,
+                item.get('status', [None])[0] if item.get('status') else None,
+                item.get('aired', [None])[0] if item.get('aired') else None,
+                item.get('premiered', None),
+                item.get('broadcast', [None])[0] if item.get('broadcast') else None,
+                item.get('source', [None])[0] if item.get('source') else None,
+                item.get('duration', [None])[0] if item.get('duration') else None,
+                item.get('rating', [None])[0] if item.get('rating') else None,
+                float(item.get('score_detail', item.get('score', 0))),
+                item.get('ranked', [None])[0] if item.get('ranked') else None,
+                item.get('popularity', [None])[0] if item.get('popularity') else None,
+                item.get('members', [None])[0] if item.get('members') else None,
+                item.get('favorites', [None])[0] if item.get('favorites') else None,
+                item.get('image_url', None)
+            ))
+            
+            anime_id = db.cursor.lastrowid
+
+            # Insert descriptions
+            descriptions = item.get('description', [])
+            if isinstance(descriptions, str):
+                descriptions = [descriptions]
+            for desc in descriptions:
+                db.cursor.execute('''
+                INSERT INTO descriptions (anime_id, description_text)
+                VALUES (?, ?)
+                ''', (anime_id, desc))
+
+            # Insert characters and voice actors
+            char_names = item.get('character_names', [])
+            char_types = item.get('character_types', [])
+            va_names = item.get('voice_actor_names', [])
+            languages = item.get('languages', [])
+            char_images = item.get('character_images', [])
+            va_images = item.get('voice_actor_images', [])
+
+            # Make sure all lists have the same length by padding with None
+            max_len = max(len(char_names), len(char_types), len(va_names), 
+                         len(languages), len(char_images), len(va_images))
+            char_names = char_names + [None] * (max_len - len(char_names))
+            char_types = char_types + [None] * (max_len - len(char_types))
+            va_names = va_names + [None] * (max_len - len(va_names))
+            languages = languages + [None] * (max_len - len(languages))
+            char_images = char_images + [None] * (max_len - len(char_images))
+            va_images = va_images + [None] * (max_len - len(va_images))
+
+            for char_name, char_type, va_name, language, char_img, va_img in zip(
+                char_names, char_types, va_names, languages, char_images, va_images
+            ):
+                if char_name or va_name:  # Only insert if we have at least a character or voice actor
+                    # Insert character
+                    if char_name:
+                        db.cursor.execute('''
+                        INSERT INTO characters (anime_id, name, character_type, image_url)
+                        VALUES (?, ?, ?, ?)
+                        ''', (anime_id, char_name, char_type, char_img))
+                        character_id = db.cursor.lastrowid
+                    else:
+                        character_id = None
+
+                    # Insert voice actor
+                    if va_name:
+                        db.cursor.execute('''
+                        INSERT INTO voice_actors (name, image_url, language)
+                        VALUES (?, ?, ?)
+                        ''', (va_name, va_img, language))
+                        voice_actor_id = db.cursor.lastrowid
+                    else:
+                        voice_actor_id = None
+
+                    # Insert relationship only if we have both IDs
+                    if character_id and voice_actor_id:
+                        db.cursor.execute('''
+                        INSERT INTO anime_character_voice (anime_id, character_id, voice_actor_id)
+                        VALUES (?, ?, ?)
+                        ''', (anime_id, character_id, voice_actor_id))
+
+            # Insert genres
+            genres = item.get('genres', [])
+            if isinstance(genres, str):
+                genres = [genres]
+            for genre in genres:
+                if genre:
+                    # Insert genre if not exists
+                    db.cursor.execute('''
+                    INSERT OR IGNORE INTO genres (genre_name)
+                    VALUES (?)
+                    ''', (genre,))
+                    
+                    # Get genre_id
+                    db.cursor.execute('SELECT genre_id FROM genres WHERE genre_name = ?', (genre,))
+                    genre_id = db.cursor.fetchone()[0]
+
+                    # Insert anime-genre relationship
+                    db.cursor.execute('''
+                    INSERT INTO anime_genres (anime_id, genre_id)
+                    VALUES (?, ?)
+                    ''', (anime_id, genre_id))
+
+            # Insert reviews
+            statuses = item.get('statuses', [])
+            numbers = item.get('numbers', [])
+            for status, number in zip(statuses, numbers):
+                if status and number:
+                    try:
+                        number_int = int(number)
+                        db.cursor.execute('''
+                        INSERT INTO reviews (anime_id, status, number_of_reviews)
+                        VALUES (?, ?, ?)
+                        ''', (anime_id, status, number_int))
+                    except (ValueError, TypeError):
+                        print(f"Warning: Invalid review number format: {number}")
+
+            successful_inserts += 1
+
+        except Exception as e:
+            failed_inserts += 1
+            print(f"Error processing item {idx}: {str(e)}")
+            print(f"Problematic item title: {item.get('title', 'Unknown')}")
+            continue
+
+    print(f"\nInsertion Summary:")
+    print(f"Successful inserts: {successful_inserts}")
+    print(f"Failed inserts: {failed_inserts}")
+    print(f"Duplicates skipped: {duplicates}")
+    print(f"Total items processed: {successful_inserts + failed_inserts + duplicates}")
+    
+    db.conn.commit()
+
+
+def benchmark(animetodb, count: int, chunk_size: int):
+    """Load `count` synthetic titles with the old row-by-row insert and with load_items."""
+    items = animetodb.synthetic_items(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = animetodb.AnimeDatabase(os.path.join(tmp, 'legacy.db'))
+        # The old schema had no unique keys or indexes
+        legacy_db.drop_unique_indexes()
+        legacy_db.drop_indexes()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy_insert_anime_data(legacy_db, items)
+        legacy_seconds = time.perf_counter() - start
+        legacy_rows = sum(legacy_db.cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                          for table in animetodb.INSERT_SQL)
+        legacy_db.conn.close()
+
+        db = animetodb.AnimeDatabase(os.path.join(tmp, 'batched.db'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = db.load_items(iter(items), chunk_size=chunk_size)
+        db.conn.close()
+
+    print(f"\nBenchmark: {count} synthetic titles, chunk size {chunk_size}")
+    report.print_report()
+    print(f"\nRow-by-row insert: {legacy_rows} rows in {legacy_seconds:.2f}s "
+          f"({legacy_rows / legacy_seconds:,.0f} rows/s, {count / legacy_seconds:,.0f} items/s)")
+    print(f"Batched load_items: {report.total_rows()} rows in {report.total_seconds:.2f}s "
+          f"({report.total_rows() / report.total_seconds:,.0f} rows/s, {count / report.total_seconds:,.0f} items/s)")
+    print(f"Speedup: {legacy_seconds / report.total_seconds:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the old row-by-row insert with load_items')
+    parser.add_argument('count', nargs='?', type=int, default=4400, help='synthetic titles to load')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='items per load_items transaction')
+    args = parser.parse_args()
+    animetodb = load_script('animetodb', 'animetodb.py', 'Load Data to DataBase')
+    benchmark(animetodb, args.count, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Micro-benchmark: old per-field selectors vs the single-pass parser in mal_parsing.py.
+
+Runs both extraction paths over saved detail pages and reports parse time per page.
+It also checks that both paths return the same item for every page.
+
+    python bench_parse.py --pages saved_pages/      # *.html / *.html.gz saved from MAL
+    python bench_parse.py --synthetic 200           # pages built by mal_pages.py
+"""
+import argparse
+import gzip
+import json
+import statistics
+import time
+from pathlib import Path
+
+from scrapy.http import HtmlResponse
+
+from mal_pages import render_detail_page, synthetic_entry
+from mal_parsing import clean_data, parse_detail_page
+
+
+def legacy_extract(response):
+    """The selectors detail_data.py used before mal_parsing.py, one document scan per field."""
+    description = clean_data(response.xpath(
+        '//p[@itemprop="description"]/text() | //p[@itemprop="description"]/br/following-sibling::text()').getall())
+    character_names = clean_data(
+        response.xpath('//td[@class="borderClass"]/h3[@class="h3_characters_voice_actors"]/a/text()').getall())
+    character_types = clean_data(
+        response.xpath('//td[@class="borderClass"]/div[@class="spaceit_pad"]/small/text()').getall())
+    voice_actor_names = clean_data(response.xpath('//td[@class="va-t ar pl4 pr4"]/a/text()').getall())
+    languages = clean_data(response.xpath('//td[@class="va-t ar pl4 pr4"]/small/text()').getall())
+    character_images = clean_data(response.css('div.picSurround img::attr(data-src)').getall())
+    voice_actor_images = clean_data(
+        response.css('td.va-t.ar.pl4.pr4 + td div.picSurround img::attr(data-src)').getall())
+
+    statuses = clean_data(response.css('div.review-ratio__box a::text').getall())
+    numbers = clean_data(response.css('div.review-ratio__box a strong::text').getall())
+
+    synonyms = clean_data(
+        response.xpath('//div[@class="spaceit_pad"][contains(., "Synonyms")]/text()').getall())
+    japanese_title = clean_data(
+        response.xpath('//div[@class="spaceit_pad"][contains(., "Japanese")]/text()').getall())
+    english_title = clean_data(
+        response.xpath('//div[@class="spaceit_pad"][contains(., "English")]/text()').getall())
+    anime_type = clean_data(response.css('div.spaceit_pad:contains("Type") a::text').get())
+    episodes = clean_data(response.css('div.spaceit_pad:contains("Episodes")::text').getall())
+    status = clean_data(response.css('div.spaceit_pad:contains("Status")::text').getall())
+    aired = clean_data(response.css('div.spaceit_pad:contains("Aired")::text').getall())
+    premiered = clean_data(response.css('div.spaceit_pad:contains("Premiered") a::text').get())
+    broadcast = clean_data(response.css('div.spaceit_pad:contains("Broadcast")::text').getall())
+    producers = clean_data(response.css('div.spaceit_pad:contains("Producers") a::text').getall())
+    licensors = clean_data(response.css('div.spaceit_pad:contains("Licensors") a::text').getall())
+    studios = clean_data(response.css('div.spaceit_pad:contains("Studios") a::text').getall())
+    source = clean_data(response.css('div.spaceit_pad:contains("Source") a::text').getall())
+    genres = clean_data(response.css('div.spaceit_pad:contains("Genres") a::text').getall())
+    themes = clean_data(response.css('div.spaceit_pad:contains("Themes") a::text').getall())
+    duration = clean_data(response.css('div.spaceit_pad:contains("Duration")::text').getall())
+    rating = clean_data(response.css('div.spaceit_pad:contains("Rating")::text').getall())
+    score = clean_data(response.css('span[itemprop="ratingValue"]::text').get())
+    ranked = clean_data(response.css('div.spaceit_pad:contains("Ranked")::text').getall())
+    popularity = clean_data(response.css('div.spaceit_pad:contains("Popularity")::text').getall())
+    members = clean_data(response.css('div.spaceit_pad:contains("Members")::text').getall())
+    favorites = clean_data(response.css('div.spaceit_pad:contains("Favorites")::text').getall())
+
+    return {
+        'description': description,
+        'character_names': character_names,
+        'character_types': character_types,
+        'voice_actor_names': voice_actor_names,
+        'languages': languages,
+        'character_images': character_images,
+        'voice_actor_images': voice_actor_images,
+        'statuses': statuses,
+        'numbers': numbers,
+        'synonyms': synonyms,
+        'japanese_title': japanese_title,
+        'english_title': english_title,
+        'anime_type': anime_type,
+        'episodes': episodes,
+        'status': status,
+        'aired': aired,
+        'premiered': premiered,
+        'broadcast': broadcast,
+        'producers': producers,
+        'licensors': licensors,
+        'studios': studios,
+        'source': source,
+        'genres': genres,
+        'themes': themes,
+        'duration': duration,
+        'rating': rating,
+        'score': score,
+        'ranked': ranked,
+        'popularity': popularity,
+        'members': members,
+        'favorites': favorites,
+    }
+
+
+def load_pages(pages_dir):
+    pages = []
+    for path in sorted(Path(pages_dir).iterdir()):
+        if path.name.endswith('.html.gz'):
+            pages.append((path.name, gzip.decompress(path.read_bytes())))
+        elif path.suffix in ('.html', '.htm'):
+            pages.append((path.name, path.read_bytes()))
+    return pages
+
+
+def synthetic_pages(count, data_file='animedata.json'):
+    try:
+        with open(data_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        entries = []
+    pages = []
+    for i in range(count):
+        entry = entries[i] if i < len(entries) else synthetic_entry(i)
+        pages.append((entry['url'], render_detail_page(entry, i).encode('utf-8')))
+    return pages
+
+
+def time_path(extract, responses, repeat):
+    """Best-of-`repeat` milliseconds per page. The lxml tree is built beforehand so only extraction is timed."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response in responses:
+            extract(response)
+        elapsed = (time.perf_counter() - start) * 1000 / len(responses)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', help='directory of saved detail pages (.html or .html.gz)')
+    parser.add_argument('--synthetic', type=int, default=100, help='number of synthetic pages if --pages is not given')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages) if args.pages else synthetic_pages(args.synthetic)
+    if not pages:
+        print("No pages to benchmark.")
+        return
+
+    responses = []
+    build_times = []
+    for name, body in pages:
+        response = HtmlResponse(url=name if name.startswith('http') else f'https://myanimelist.net/{name}',
+                                body=body, encoding='utf-8')
+        start = time.perf_counter()
+        response.selector  # build and cache the lxml tree
+        build_times.append((time.perf_counter() - start) * 1000)
+        responses.append(response)
+
+    mismatches = []
+    for response in responses:
+        old, new = legacy_extract(response), parse_detail_page(response)
+        if old != new:
+            fields = [key for key in old if old[key] != new.get(key)]
+            mismatches.append(f"{response.url}: {', '.join(fields)}")
+
+    old_ms = time_path(legacy_extract, responses, args.repeat)
+    new_ms = time_path(parse_detail_page, responses, args.repeat)
+    avg_kb = statistics.mean(len(body) for _, body in pages) / 1024
+
+    print(f"Pages: {len(pages)} (avg {avg_kb:.0f} KB), best of {args.repeat} runs")
+    print(f"HTML tree build:       {statistics.mean(build_times):8.3f} ms/page (same for both paths)")
+    print(f"Old per-field queries: {old_ms:8.3f} ms/page")
+    print(f"Single-pass parser:    {new_ms:8.3f} ms/page")
+    print(f"Speedup:               {old_ms / new_ms:8.1f}x")
+    if mismatches:
+        print(f"\n{len(mismatches)} pages differ between the two paths:")
+        for line in mismatches[:10]:
+            print(f"- {line}")
+    else:
+        print("Both paths returned identical items for every page.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Query benchmark for usedb.py.
+
+Builds synthetic animelist.db files at several multiples of the real data set
+(animedata.json has about 4,450 titles) and runs every query function in usedb.py
+against each one, with and without the secondary indexes. Latency and the
+EXPLAIN QUERY PLAN of every statement are written to a JSON file; pass an older
+file to --compare to see which queries got slower or changed plan.
+
+    python bench_queries.py --scales 10 100 --out query_bench.json
+    python bench_queries.py --scales 10 --compare query_bench.json
+
+usedb.py and "Load Data to DataBase" are loaded with repo_scripts.load_script, so
+the code below their note's dashed line is used when they are not importable as they are.
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from repo_scripts import load_script
+
+BASE_TITLES = 4450
+
+# Arguments for query functions that need one
+QUERY_ARGS = {'anime_title': None, 'text': None}  # filled with a title from the middle of the table
+
+
+def query_functions(usedb):
+    """Every query function defined in usedb.py (everything except main)."""
+    return {name: func for name, func in inspect.getmembers(usedb, inspect.isfunction)
+            if func.__module__ == usedb.__name__ and name != 'main'}
+
+
+def call_args(func, args):
+    return [args[name] for name, param in inspect.signature(func).parameters.items()
+            if param.default is inspect.Parameter.empty]
+
+
+def explain(conn, statements):
+    plans = []
+    for sql in statements:
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+        plans.append({'sql': ' '.join(sql.split()), 'plan': [row[-1] for row in rows]})
+    return plans
+
+
+def run_queries(usedb, args, repeat):
+    results = {}
+    for name, func in query_functions(usedb).items():
+        func_args = call_args(func, args)
+        statements = []
+        usedb.conn.set_trace_callback(statements.append)
+        timings = []
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = func(*func_args)
+                timings.append((time.perf_counter() - start) * 1000)
+                usedb.conn.set_trace_callback(None)
+        finally:
+            usedb.conn.set_trace_callback(None)
+        results[name] = {
+            'best_ms': min(timings),
+            'median_ms': statistics.median(timings),
+            'rows': len(result) if hasattr(result, '__len__') else result,
+            # Functions that open their own connection (check_database_content) have no plan here
+            'plans': explain(usedb.conn, list(dict.fromkeys(statements))),
+        }
+    return results
+
+
+def build_database(animetodb, path, titles, chunk_size):
+    start = time.perf_counter()
+    db = animetodb.AnimeDatabase(str(path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.load_items(animetodb.iter_synthetic_items(titles), chunk_size=chunk_size)
+    seconds = time.perf_counter() - start
+    return db, seconds
+
+
+def bench_scale(animetodb, usedb_module_name, scale, repeat, chunk_size, workdir):
+    titles = int(BASE_TITLES * scale)
+    db_path = Path(workdir) / 'animelist.db'
+    if db_path.exists():
+        db_path.unlink()
+    db, build_seconds = build_database(animetodb, db_path, titles, chunk_size)
+    rows = {table: db.cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            for table in animetodb.INSERT_SQL}
+
+    # usedb.py opens 'animelist.db' relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.modules.pop(usedb_module_name, None)
+        usedb = load_script(usedb_module_name, 'usedb.py')
+        args = dict(QUERY_ARGS, anime_title=f'Synthetic Anime {titles // 2}', text=f'Synthetic Anime {titles // 2}')
+        variants = {'indexed': run_queries(usedb, args, repeat)}
+        db.drop_indexes()
+        db.cursor.execute('ANALYZE')
+        db.conn.commit()
+        variants['no_indexes'] = run_queries(usedb, args, repeat)
+        usedb.conn.close()
+    finally:
+        os.chdir(cwd)
+        db.conn.close()
+
+    return {
+        'scale': scale,
+        'titles': titles,
+        'build_seconds': build_seconds,
+        'size_bytes': db_path.stat().st_size,
+        'rows': rows,
+        'variants': variants,
+    }
+
+
+def print_run(run):
+    print(f"\nScale {run['scale']}x: {run['titles']:,} titles, {sum(run['rows'].values()):,} rows, "
+          f"{run['size_bytes'] / 1024 / 1024:.1f} MB, built in {run['build_seconds']:.1f}s")
+    print(f"{'query':<28}{'no indexes ms':>15}{'indexed ms':>12}{'speedup':>9}  plan (indexed)")
+    indexed, plain = run['variants']['indexed'], run['variants']['no_indexes']
+    for name in indexed:
+        before, after = plain[name]['best_ms'], indexed[name]['best_ms']
+        plan = '; '.join(step for p in indexed[name]['plans'] for step in p['plan'][:2])
+        print(f"{name:<28}{before:>15.2f}{after:>12.2f}{before / after if after else 0:>8.1f}x  {plan[:70]}")
+
+
+def compare(previous, current, threshold):
+    """Print queries that got slower than `threshold` times or changed plan. Returns the count."""
+    old_runs = {run['scale']: run for run in previous['runs']}
+    problems = 0
+    for run in current['runs']:
+        old = old_runs.get(run['scale'])
+        if old is None:
+            continue
+        for variant, queries in run['variants'].items():
+            for name, result in queries.items():
+                before = old['variants'].get(variant, {}).get(name)
+                if before is None:
+                    continue
+                ratio = result['best_ms'] / before['best_ms'] if before['best_ms'] else 1.0
+                # Ignore sub-millisecond jitter
+                slower = ratio >= threshold and result['best_ms'] - before['best_ms'] > 1.0
+                old_plan = [p['plan'] for p in before['plans']]
+                new_plan = [p['plan'] for p in result['plans']]
+                if slower or old_plan != new_plan:
+                    problems += 1
+                    what = f"{ratio:.1f}x slower" if slower else 'plan changed'
+                    print(f"- {run['scale']}x {variant} {name}: {what} "
+                          f"({before['best_ms']:.2f} -> {result['best_ms']:.2f} ms)")
+                    if old_plan != new_plan:
+                        print(f"    was: {old_plan}\n    now: {new_plan}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=float, nargs='+', default=[10],
+                        help=f'multiples of the real data set ({BASE_TITLES} titles)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--out', default='query_bench.json')
+    parser.add_argument('--compare', help='earlier --out file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    animetodb = load_script('animetodb', 'animetodb.py', 'Load Data to DataBase')
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'repeat': args.repeat,
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scales:
+            run = bench_scale(animetodb, 'usedb', scale, args.repeat, args.chunk_size, workdir)
+            results['runs'].append(run)
+            print_run(run)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"\nCompared with {args.compare}:")
+        problems = compare(previous, results, args.threshold)
+        if not problems:
+            print("No slower queries and no plan changes.")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Sharded multi-process detail crawl.
+
+Seeds one shared frontier (crawl_frontier.py) with the URL list, one entry per MAL
+anime id, sharded by id. It then starts N anime_detail workers on it. Each worker
+claims URLs with a lease (its own shard first, then whatever is left) and appends
+items to its own JSON Lines file. At the end the per-worker files are merged into
+one dataset in URL-list order, with every anime once.
+
+    python crawl_coordinator.py --workers 4 -o anime_details.jsonl
+    python crawl_coordinator.py --workers 4 --spider-file detail_data.py -o anime.json
+
+By default workers run `scrapy crawl anime_detail` in the Scrapy project (the
+directory with scrapy.cfg). --spider-file runs `scrapy runspider` on a copy of FILE in
+the work directory instead (without the note above the dashed line, if it has one). A
+worker that dies has its URLs put back and is restarted. If a worker hangs, its
+leases run out and the others take its URLs over. Running the same command again
+after a crash picks up where the crawl stopped.
+
+Beyond the top 4,400: --data takes any URL list in animedata.json layout. To try
+it offline, run against the local stand-in (mal_standin.py):
+
+    python crawl_coordinator.py --workers 4 --spider-file detail_data.py --standin 20000 --latency 0.2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from crawl_frontier import Frontier
+from mal_pages import synthetic_entry
+from repo_scripts import script_code
+
+HERE = Path(__file__).resolve().parent
+
+
+def runnable_spider_file(spider_file, work_dir):
+    """
+    A copy of --spider-file the workers can run: detail_data.py starts with a note
+    above a dashed line, the copy has only the code below it.
+    """
+    path = work_dir / Path(spider_file).name
+    path.write_text(script_code(spider_file), encoding='utf-8')
+    return str(path)
+
+
+def worker_command(args, frontier_path, data_file, index, out_path, settings):
+    if args.spider_file:
+        command = ['scrapy', 'runspider', args.spider_file]
+    else:
+        command = ['scrapy', 'crawl', 'anime_detail']
+    spider_args = {
+        'frontier': frontier_path,
+        'out': out_path,
+        'data': data_file,
+        'worker': f'worker-{index}',
+        'shard': index,
+        'lease': args.lease,
+        'window': args.window,
+        'max_attempts': args.max_attempts,
+    }
+    for name, value in spider_args.items():
+        command += ['-a', f'{name}={value}']
+    for name, value in settings.items():
+        command += ['-s', f'{name}={json.dumps(value) if isinstance(value, (dict, list)) else value}']
+    return command
+
+
+def start_worker(args, frontier_path, data_file, index, settings, work_dir):
+    out_path = str(work_dir / f'worker-{index}.jsonl')
+    log = open(work_dir / f'worker-{index}.log', 'ab')
+    command = worker_command(args, frontier_path, data_file, index, out_path, settings)
+    # Workers import crawl_frontier, page_cache, mal_standin... from next to this script
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (str(HERE), os.getcwd(), env.get('PYTHONPATH')) if p)
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env), log
+
+
+def run_workers(args, frontier, data_file, settings, work_dir):
+    """Run the workers until the frontier has nothing left to do. Returns the number of restarts."""
+    workers = {}
+    for index in range(args.workers):
+        workers[index] = start_worker(args, frontier.path, data_file, index, settings, work_dir)
+    restarts = 0
+    last_report = 0.0
+    while workers:
+        time.sleep(1)
+        for index, (process, log) in list(workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            log.close()
+            del workers[index]
+            if code != 0:
+                # Its in-flight URLs go back to pending straight away instead of waiting for the lease
+                released = frontier.release(f'worker-{index}')
+                print(f"worker-{index} exited with code {code}, {released} URLs released "
+                      f"(log: {work_dir / f'worker-{index}.log'})")
+                if restarts < args.max_restarts and frontier.unfinished():
+                    restarts += 1
+                    workers[index] = start_worker(args, frontier.path, data_file, index, settings, work_dir)
+        # A live worker whose leases ran out is stuck: stop it, the loop above restarts it
+        expired = {worker for worker, in frontier.conn.execute(
+            "SELECT DISTINCT worker FROM frontier WHERE state = 'in_flight' AND lease_until < ?", (time.time(),))}
+        for index, (process, log) in workers.items():
+            if f'worker-{index}' in expired and process.poll() is None:
+                print(f"worker-{index} let its leases expire, stopping it")
+                process.kill()
+        # Workers that finished cleanly while others' URLs were released: one more pass
+        if not workers and frontier.unfinished() and restarts < args.max_restarts:
+            restarts += 1
+            workers[0] = start_worker(args, frontier.path, data_file, 0, settings, work_dir)
+        if time.time() - last_report >= args.report_every:
+            last_report = time.time()
+            print(f"{time.strftime('%H:%M:%S')} {len(workers)} workers, {frontier.counts()}")
+    return restarts
+
+
+def merge(frontier, output):
+    """
+    Write every done item in URL-list order, one per MAL id, reading each line from
+    where its worker recorded it. Returns (written, duplicates skipped).
+    """
+    files = {}
+    seen = set()
+    written = duplicates = 0
+    tmp = f'{output}.tmp'
+    array = output.endswith('.json')
+    rows = frontier.conn.execute('''
+    SELECT anime_id, sink, sink_offset, sink_length FROM frontier
+    WHERE state = 'done' AND sink IS NOT NULL ORDER BY position''')
+    try:
+        with open(tmp, 'wb') as out:
+            if array:
+                out.write(b'[')
+            for anime_id, sink, offset, length in rows:
+                if anime_id is not None:
+                    if anime_id in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(anime_id)
+                if sink not in files:
+                    files[sink] = open(sink, 'rb')
+                files[sink].seek(offset)
+                line = files[sink].read(length)
+                if array:
+                    out.write((b',\n' if written else b'\n') + line.rstrip(b'\n'))
+                else:
+                    out.write(line)
+                written += 1
+            if array:
+                out.write(b'\n]')
+    finally:
+        for f in files.values():
+            f.close()
+    os.replace(tmp, output)
+    return written, duplicates
+
+
+def prepare_data(args, work_dir):
+    """The URL list the workers read: --data, or --standin N entries padded with synthetic ones."""
+    if not args.standin:
+        return os.path.abspath(args.data)
+    with open(args.data, 'r', encoding='utf-8') as f:
+        entries = json.load(f)[:args.standin]
+    entries += [synthetic_entry(i) for i in range(len(entries), args.standin)]
+    data_file = work_dir / 'standin_data.json'
+    with open(data_file, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+    return str(data_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--data', default='animedata.json', help='URL list (animedata.json layout)')
+    parser.add_argument('-o', '--output', default='anime_details.jsonl',
+                        help='merged dataset, a JSON array for *.json, JSON Lines otherwise')
+    parser.add_argument('--work-dir', default='crawl_work', help='shared frontier, per-worker files and logs')
+    parser.add_argument('--spider-file', help='run workers with scrapy runspider FILE instead of scrapy crawl')
+    parser.add_argument('--window', type=int, default=8, help='pages in flight per worker')
+    parser.add_argument('--lease', type=float, default=120, help='seconds before a silent worker loses its URLs')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--max-restarts', type=int, default=10, help='worker restarts after crashes')
+    parser.add_argument('--report-every', type=float, default=10, help='seconds between progress lines')
+    parser.add_argument('--standin', type=int, metavar='PAGES',
+                        help='crawl a local stand-in serving PAGES anime (animedata.json + synthetic)')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in response latency, seconds')
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    data_file = prepare_data(args, work_dir)
+    if args.spider_file:
+        args.spider_file = runnable_spider_file(args.spider_file, work_dir)
+    with open(data_file, 'r', encoding='utf-8') as f:
+        urls = [entry['url'] for entry in json.load(f)]
+
+    frontier = Frontier(str(work_dir / 'frontier.db'), args.max_attempts)
+    added = frontier.seed(urls, shards=args.workers, dedupe=True)
+    # Requeue failures with attempts left and anything still in flight from an earlier, killed coordinator
+    requeued = frontier.recover()
+    print(f"{len(urls)} URLs, {added} new in the frontier, {requeued} requeued: {frontier.counts()}")
+
+    settings = {}
+    server = None
+    if args.standin:
+        from mal_standin import StandInSite, make_server, standin_settings
+        with open(data_file, 'r', encoding='utf-8') as f:
+            site = StandInSite(json.load(f), latency=args.latency)
+        server = make_server(site)
+        settings.update(standin_settings(server.url))
+        settings['LOG_LEVEL'] = 'INFO'
+
+    start = time.perf_counter()
+    try:
+        restarts = run_workers(args, frontier, data_file, settings, work_dir)
+    finally:
+        if server is not None:
+            server.shutdown()
+    seconds = time.perf_counter() - start
+
+    counts = frontier.counts()
+    written, duplicates = merge(frontier, args.output)
+    frontier.close()
+    print(f"\nCrawled with {args.workers} workers in {seconds:.1f}s ({counts['done'] / seconds:.1f} pages/s, "
+          f"{restarts} restarts): {counts}")
+    print(f"Merged {written} items into {args.output} ({duplicates} duplicate ids skipped)")
+    if counts['pending'] or counts['in_flight'] or counts['failed']:
+        print(f"Unfinished or failed URLs remain, run the same command again "
+              f"(python crawl_frontier.py status --db {work_dir / 'frontier.db'})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Durable crawl frontier for the detail spider.
+
+A SQLite table holds every animedata.json entry with its state:
+
+    pending -> in_flight -> done
+                         -> failed   (retried on the next run while attempts < max_attempts)
+
+Items go to an append-only JSON Lines file. Every checkpoint fsyncs the file and
+commits the done/failed marks together with the file's length, so the two never
+disagree: after a crash the next run cuts the file back to the last checkpoint
+(no half-written line, no duplicate items) and requeues whatever was in flight.
+
+    scrapy crawl anime_detail -a frontier=frontier.db -a out=anime_details.jsonl
+    (kill it, run the same command again: only unfinished URLs are requested)
+
+Several processes can share one frontier (crawl_coordinator.py does this). Each
+then claims URLs under its worker name with a lease, preferring its own shard
+(MAL anime id modulo the shard count) and taking over other shards' pending URLs
+and expired leases once its own shard is empty.
+
+    python crawl_frontier.py status --db frontier.db
+    python crawl_frontier.py retry-failed --db frontier.db    # give up-on URLs another go
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from mal_parsing import anime_id_from_url
+
+logger = logging.getLogger(__name__)
+
+STATES = ('pending', 'in_flight', 'done', 'failed')
+
+# Columns added after the first version of the table, for frontier files from older runs
+COLUMNS = {
+    'anime_id': 'INTEGER',
+    'shard': 'INTEGER NOT NULL DEFAULT 0',
+    'worker': 'TEXT',
+    'lease_until': 'REAL',
+    'sink': 'TEXT',
+    'sink_offset': 'INTEGER',
+    'sink_length': 'INTEGER',
+}
+
+
+class JsonlSink:
+    """Append-only JSON Lines file whose durable length is tracked by the frontier."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.file = open(path, 'ab')
+        self.offset = self.file.tell()  # bytes known to be on disk
+        self.count = 0
+
+    def truncate(self, offset):
+        """Drop anything written after `offset` (lines from a run that crashed before its checkpoint)."""
+        self.file.truncate(offset)
+        self.file.seek(offset)
+        self.offset = offset
+
+    def write(self, item):
+        """Append one item. Returns where its line is: (path, offset, length)."""
+        line = (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+        offset = self.file.tell()
+        self.file.write(line)
+        self.count += 1
+        return self.path, offset, len(line)
+
+    def sync(self):
+        """Flush to disk and return the new durable length."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.offset = self.file.tell()
+        return self.offset
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class Frontier:
+    """
+    URL states of one crawl, keyed by position in animedata.json (the file repeats a few URLs).
+    `worker` names this process when several share the file; leases expire after `lease` seconds.
+    """
+
+    def __init__(self, path='frontier.db', max_attempts=3, worker=None, shard=0, lease=300.0,
+                 checkpoint_every=20):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.worker = worker
+        self.shard = shard
+        self.lease = lease
+        self.checkpoint_every = checkpoint_every
+        # Autocommit, transactions are opened explicitly and kept short so workers rarely wait
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS frontier (
+            position INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated REAL
+        )''')
+        existing = {row[1] for row in self.conn.execute('PRAGMA table_info(frontier)')}
+        for column, sql_type in COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f'ALTER TABLE frontier ADD COLUMN {column} {sql_type}')
+        self.conn.execute('DROP INDEX IF EXISTS idx_frontier_state')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_claim ON frontier(state, shard, position)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS frontier_meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.marks = []  # (state, position, error, location) waiting for the next checkpoint
+        self.last_checkpoint = time.time()
+
+    @property
+    def dirty(self):
+        return len(self.marks)
+
+    def seed(self, urls, shards=1, dedupe=False):
+        """
+        Add entries that are not in the frontier yet, sharded by MAL id. With `dedupe`
+        only the first entry of each anime is added. Returns how many were added.
+        """
+        rows = []
+        seen = set()
+        for position, url in enumerate(urls):
+            anime_id = anime_id_from_url(url)
+            if dedupe and anime_id is not None:
+                if anime_id in seen:
+                    continue
+                seen.add(anime_id)
+            rows.append((position, url, anime_id, (anime_id or position) % shards))
+        before = self.conn.total_changes
+        with self.transaction():
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO frontier (position, url, anime_id, shard) VALUES (?, ?, ?, ?)', rows)
+        return self.conn.total_changes - before
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM frontier_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO frontier_meta VALUES (?, ?)', (key, str(value)))
+
+    def recover(self, sink=None):
+        """
+        Make the frontier and the sink agree after an earlier run: cut the sink back to
+        the last checkpoint and requeue in-flight URLs (only this worker's when shared)
+        and failed URLs with attempts left.
+        """
+        with self.transaction():
+            requeued = self.conn.execute(
+                "UPDATE frontier SET state = 'pending', worker = NULL, lease_until = NULL "
+                "WHERE state = 'failed' AND attempts < ?", (self.max_attempts,)).rowcount
+            requeued += self.release(self.worker) if self.worker else self.release()
+            if sink is None:
+                return requeued
+
+            key = f'sink_offset:{sink.path}'
+            committed = self.get_meta(key)
+            size = os.path.getsize(sink.path)
+            if committed is None:
+                if size:
+                    logger.info(f"Appending to {sink.path}, which this frontier has not written to before")
+            elif size > int(committed):
+                logger.info(f"Dropping {size - int(committed)} bytes written to {sink.path} after the last checkpoint")
+                sink.truncate(int(committed))
+            elif size < int(committed):
+                logger.warning(f"{sink.path} is shorter than the frontier recorded ({size} < {committed} bytes); "
+                               f"items of URLs marked done may be missing from it")
+            self.set_meta(key, sink.offset)
+        return requeued
+
+    def release(self, worker=None):
+        """Put in-flight URLs (all, or one worker's) back to pending. Returns how many."""
+        if worker is None:
+            sql, args = "WHERE state = 'in_flight'", ()
+        else:
+            sql, args = "WHERE state = 'in_flight' AND worker = ?", (worker,)
+        return self.conn.execute(
+            f"UPDATE frontier SET state = 'pending', worker = NULL, lease_until = NULL {sql}", args).rowcount
+
+    def claim(self, limit):
+        """
+        Up to `limit` (position, url) pairs, lowest position first, now in flight for this
+        worker: pending URLs of its own shard, then other shards', then expired leases.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self.transaction():
+            rows = self.conn.execute(
+                "SELECT position, url FROM frontier WHERE state = 'pending' AND shard = ? ORDER BY position LIMIT ?",
+                (self.shard, limit)).fetchall()
+            if len(rows) < limit:
+                rows += self.conn.execute(
+                    "SELECT position, url FROM frontier WHERE state = 'pending' AND shard != ? "
+                    "ORDER BY position LIMIT ?", (self.shard, limit - len(rows))).fetchall()
+            if len(rows) < limit and self.worker is not None:
+                rows += self.conn.execute(
+                    "SELECT position, url FROM frontier WHERE state = 'in_flight' AND lease_until < ? "
+                    "ORDER BY position LIMIT ?", (now, limit - len(rows))).fetchall()
+            self.conn.executemany(
+                "UPDATE frontier SET state = 'in_flight', attempts = attempts + 1, worker = ?, lease_until = ?, "
+                "updated = ? WHERE position = ?",
+                [(self.worker, now + self.lease, now, position) for position, _ in rows])
+        return rows
+
+    def mark_done(self, position, location=None):
+        """`location` is what JsonlSink.write returned; recorded at the next checkpoint."""
+        self.marks.append(('done', position, None, location or (None, None, None)))
+
+    def mark_failed(self, position, error):
+        self.marks.append(('failed', position, str(error)[:500], (None, None, None)))
+
+    def due(self):
+        """Time for a checkpoint: enough marks waiting, or leases getting old."""
+        return (len(self.marks) >= self.checkpoint_every
+                or (self.marks and time.time() - self.last_checkpoint > self.lease / 4))
+
+    def checkpoint(self, sink=None):
+        """Make everything written so far durable: sink first, then the marks and the sink length."""
+        offset = sink.sync() if sink is not None else None
+        now = time.time()
+        with self.transaction():
+            # A URL whose lease was taken over meanwhile belongs to the other worker now
+            self.conn.executemany(
+                "UPDATE frontier SET state = ?, last_error = ?, sink = ?, sink_offset = ?, sink_length = ?, "
+                "lease_until = NULL, updated = ? WHERE position = ? AND state = 'in_flight' AND worker IS ?",
+                [(state, error, path, line_offset, length, now, position, self.worker)
+                 for state, position, error, (path, line_offset, length) in self.marks])
+            if sink is not None:
+                self.set_meta(f'sink_offset:{sink.path}', offset)
+            if self.worker is not None:
+                self.conn.execute("UPDATE frontier SET lease_until = ? WHERE state = 'in_flight' AND worker = ?",
+                                  (now + self.lease, self.worker))
+        self.marks = []
+        self.last_checkpoint = now
+
+    def retry_failed(self):
+        """Requeue every failed URL with a fresh attempt count."""
+        return self.conn.execute(
+            "UPDATE frontier SET state = 'pending', attempts = 0, worker = NULL WHERE state = 'failed'").rowcount
+
+    def counts(self):
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.conn.execute('SELECT state, COUNT(*) FROM frontier GROUP BY state'))
+        return counts
+
+    def unfinished(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM frontier WHERE state IN ('pending', 'in_flight')").fetchone()[0]
+
+    def sinks(self):
+        """{sink path: committed length} for every sink written through this frontier."""
+        return {key.split(':', 1)[1]: int(value) for key, value in self.conn.execute(
+            "SELECT key, value FROM frontier_meta WHERE key LIKE 'sink_offset:%'")}
+
+    def close(self):
+        self.conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error) on an autocommit connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['status', 'retry-failed'])
+    parser.add_argument('--db', default='frontier.db')
+    parser.add_argument('--errors', type=int, default=10, help='failed URLs to list with status')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    frontier = Frontier(args.db)
+    try:
+        if args.command == 'retry-failed':
+            print(f"Requeued {frontier.retry_failed()} failed URLs")
+            return
+        counts = frontier.counts()
+        print(f"{args.db}: " + ', '.join(f"{state} {count}" for state, count in counts.items()))
+        for path, length in frontier.sinks().items():
+            print(f"Output: {path} ({length:,} bytes)")
+        workers = frontier.conn.execute(
+            "SELECT worker, COUNT(*) FROM frontier WHERE state = 'in_flight' GROUP BY worker").fetchall()
+        for worker, count in workers:
+            print(f"  in flight for {worker or '(single process)'}: {count}")
+        failed = frontier.conn.execute(
+            "SELECT url, attempts, last_error FROM frontier WHERE state = 'failed' ORDER BY position LIMIT ?",
+            (args.errors,)).fetchall()
+        for url, attempts, error in failed:
+            print(f"  failed x{attempts}: {url}  {error}")
+    finally:
+        frontier.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Timings for the scrape -> JSON -> AnimeDatabase -> usedb.py flow.
+
+Every stage records into a StatsRecorder and saves it under its own name in one
+stats file (crawl_stats.json), next to a Prometheus text version (crawl_stats.prom):
+
+    crawl    download latency per page type, parse time per extraction step
+             (mal_parsing.DETAIL_STEPS), items/s and pages/s     CrawlStatsExtension
+    load     rows and rows/s per table, items/s                  animetodb.py --stats
+    queries  latency of every report query                       usedb.py
+
+Timings over a threshold are kept as "slow" entries with the URL or query they
+belong to, so slow pages and slow selectors can be found without DEBUG logs.
+
+The extension is listed in both spiders but only runs when asked for:
+
+    scrapy crawl anime -s CRAWL_STATS_ENABLED=1 -o anime.json
+    scrapy crawl anime -s CRAWL_STATS_ENABLED=1 -s CRAWL_STATS_PROFILE=5114   # cProfile one page
+    scrapy crawl anime -s CRAWL_STATS_ENABLED=1 -s CRAWL_STATS_PROFILE=batch:200
+
+Settings (defaults in brackets):
+    CRAWL_STATS_ENABLED     [False]
+    CRAWL_STATS_FILE        [crawl_stats.json]
+    CRAWL_STATS_SLOW_URL    [2.0]   seconds of download latency
+    CRAWL_STATS_SLOW_STEP   [0.05]  seconds for one extraction step on one page
+    CRAWL_STATS_PROFILE     ['']    a URL substring (that page) or batch:N (the first N pages)
+    CRAWL_STATS_PROFILE_OUT [crawl_profile.prof]
+
+    python crawl_stats.py                  # summary of crawl_stats.json
+"""
+import argparse
+import bisect
+import cProfile
+import heapq
+import io
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+from mal_parsing import parse_detail_page
+
+# Histogram bucket upper bounds, seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Metric -> seconds above which one observation is kept as a slow entry
+SLOW_THRESHOLDS = {
+    'download_latency_seconds': 2.0,
+    'parse_step_seconds': 0.05,
+    'query_seconds': 0.5,
+}
+
+HELP = {
+    'download_latency_seconds': 'Time from sending a request to receiving its response',
+    'parse_seconds': 'Time to extract one detail page',
+    'parse_step_seconds': 'Time of one extraction step on one detail page',
+    'query_seconds': 'Latency of one usedb.py report query',
+    'load_seconds': 'Time animetodb.py spent on a load stage',
+    'responses_total': 'Responses received, by status',
+    'items_total': 'Items scraped',
+    'rows_total': 'Rows written per table',
+    'items_per_second': 'Items per second over the whole stage',
+    'pages_per_second': 'Responses per second over the whole stage',
+    'rows_per_second': 'Rows written per second per table',
+}
+
+
+class Histogram:
+    """Bucketed latencies plus count, sum, min and max."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the max for the +Inf bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class StatsRecorder:
+    """Histograms, counters, gauges and slow entries of one stage."""
+
+    def __init__(self, stage, slow_thresholds=None, keep_slow=25):
+        self.stage = stage
+        self.slow_thresholds = dict(SLOW_THRESHOLDS, **(slow_thresholds or {}))
+        self.keep_slow = keep_slow
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}
+        self.gauges = {}
+        self.slow = []  # min-heap of (seconds, metric, key, labels), the keep_slow slowest
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, key=None, **labels):
+        """Record one timing. `key` (a URL, a query) is kept when the timing is over the metric's threshold."""
+        metric = self._key(name, labels)
+        if metric not in self.histograms:
+            self.histograms[metric] = Histogram()
+        self.histograms[metric].observe(seconds)
+        threshold = self.slow_thresholds.get(name)
+        if key is not None and threshold is not None and seconds >= threshold:
+            entry = (seconds, name, key, metric[1])
+            if len(self.slow) < self.keep_slow:
+                heapq.heappush(self.slow, entry)
+            else:
+                heapq.heappushpop(self.slow, entry)
+
+    def inc(self, name, value=1, **labels):
+        metric = self._key(name, labels)
+        self.counters[metric] = self.counters.get(metric, 0) + value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[self._key(name, labels)] = value
+
+    @contextmanager
+    def timer(self, name, key=None, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, key, **labels)
+
+    def record_steps(self, timings, url):
+        """Timings from parse_detail_page(response, timings) for one page."""
+        for step, seconds in timings.items():
+            self.observe('parse_step_seconds', seconds, url, step=step)
+        self.observe('parse_seconds', sum(timings.values()), url)
+
+    def to_dict(self):
+        def entries(metrics, value):
+            return [{'name': name, 'labels': dict(labels), **value(v)} for (name, labels), v in metrics.items()]
+
+        return {
+            'stage': self.stage,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+            'seconds': round(time.time() - self.started, 3),
+            'histograms': entries(self.histograms, Histogram.to_dict),
+            'counters': entries(self.counters, lambda v: {'value': v}),
+            'gauges': entries(self.gauges, lambda v: {'value': v}),
+            'slow': [{'metric': name, 'key': key, 'labels': dict(labels), 'seconds': round(seconds, 4)}
+                     for seconds, name, key, labels in sorted(self.slow, reverse=True)],
+        }
+
+    def save(self, path='crawl_stats.json'):
+        """Write this stage into the stats file, keeping the other stages, and refresh the .prom file."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                stages = json.load(f).get('stages', {})
+        except (FileNotFoundError, ValueError):
+            stages = {}
+        stages[self.stage] = self.to_dict()
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'stages': stages}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+        with open(os.path.splitext(path)[0] + '.prom', 'w', encoding='utf-8') as f:
+            f.write(prometheus_text(stages))
+        return path
+
+
+def _labels(stage, labels, **extra):
+    pairs = dict({'stage': stage}, **labels, **extra)
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in pairs.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text(stages):
+    """Prometheus text exposition format for the stages of a stats file, metric names prefixed with mal_."""
+    families = {}  # name -> (type, lines)
+    for stage, data in stages.items():
+        for h in data['histograms']:
+            _, lines = families.setdefault(h['name'], ('histogram', []))
+            cumulative = 0
+            for bound, count in h['buckets'].items():
+                cumulative += count
+                lines.append(f"mal_{h['name']}_bucket{_labels(stage, h['labels'], le=bound)} {cumulative}")
+            lines.append(f"mal_{h['name']}_sum{_labels(stage, h['labels'])} {h['sum']}")
+            lines.append(f"mal_{h['name']}_count{_labels(stage, h['labels'])} {h['count']}")
+        for kind, metrics in (('counter', data['counters']), ('gauge', data['gauges'])):
+            for m in metrics:
+                _, lines = families.setdefault(m['name'], (kind, []))
+                lines.append(f"mal_{m['name']}{_labels(stage, m['labels'])} {m['value']}")
+
+    out = []
+    for name, (kind, lines) in families.items():
+        if name in HELP:
+            out.append(f'# HELP mal_{name} {HELP[name]}')
+        out.append(f'# TYPE mal_{name} {kind}')
+        out.extend(lines)
+    return '\n'.join(out) + '\n'
+
+
+class Profiler:
+    """
+    Opt-in cProfile around page parsing: `target` is a URL substring (profile that
+    page) or 'batch:N' (profile the first N pages together).
+    """
+
+    def __init__(self, target, out_path='crawl_profile.prof'):
+        self.out_path = out_path
+        self.substring = None
+        self.remaining = 0
+        if target.startswith('batch:'):
+            self.remaining = int(target.split(':', 1)[1])
+        else:
+            self.substring = target
+        self.profile = cProfile.Profile()
+        self.pages = 0
+
+    def wants(self, url):
+        if self.substring is not None:
+            return self.substring in url
+        return self.remaining > 0
+
+    @contextmanager
+    def run(self, url):
+        if not self.wants(url):
+            yield
+            return
+        self.remaining -= 1
+        self.pages += 1
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def dump(self, top=15):
+        """Write the .prof file and return the top functions by cumulative time, or None if nothing ran."""
+        if not self.pages:
+            return None
+        self.profile.dump_stats(self.out_path)
+        text = io.StringIO()
+        pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(top)
+        return text.getvalue()
+
+
+@contextmanager
+def profiled(out_path, top=15):
+    """cProfile a block of code (a whole load, one report) into `out_path` and print the top functions."""
+    profiler = Profiler('batch:1', out_path)
+    with profiler.run(''):
+        yield
+    print(profiler.dump(top))
+    print(f"Profile written to {out_path} (open with: python -m pstats {out_path})")
+
+
+def timed_parse(spider, response):
+    """parse_detail_page, timed per step when the spider runs with CrawlStatsExtension."""
+    recorder = getattr(spider, 'crawl_stats', None)
+    if recorder is None:
+        return parse_detail_page(response)
+    timings = {}
+    profiler = getattr(spider, 'crawl_profiler', None)
+    if profiler is None:
+        details = parse_detail_page(response, timings)
+    else:
+        with profiler.run(response.url):
+            details = parse_detail_page(response, timings)
+    recorder.record_steps(timings, response.url)
+    return details
+
+
+def page_type(url):
+    return 'list' if 'topanime.php' in url else 'detail'
+
+
+class CrawlStatsExtension:
+    def __init__(self, crawler):
+        # Imported here so the loader and usedb.py can use the recorder without Scrapy installed
+        from scrapy import signals
+        from scrapy.exceptions import NotConfigured
+
+        settings = crawler.settings
+        if not settings.getbool('CRAWL_STATS_ENABLED', False):
+            raise NotConfigured
+        self.path = settings.get('CRAWL_STATS_FILE', 'crawl_stats.json')
+        self.recorder = StatsRecorder('crawl', {
+            'download_latency_seconds': settings.getfloat('CRAWL_STATS_SLOW_URL', 2.0),
+            'parse_step_seconds': settings.getfloat('CRAWL_STATS_SLOW_STEP', 0.05),
+        })
+        target = settings.get('CRAWL_STATS_PROFILE', '')
+        self.profiler = Profiler(target, settings.get('CRAWL_STATS_PROFILE_OUT', 'crawl_profile.prof')) \
+            if target else None
+        self.responses = 0
+        self.items = 0
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        # timed_parse() looks these up on the spider
+        spider.crawl_stats = self.recorder
+        spider.crawl_profiler = self.profiler
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+        page = page_type(response.url)
+        cached = 'cached' in response.flags
+        self.recorder.inc('responses_total', page=page, status=str(response.status), cached=str(cached).lower())
+        latency = request.meta.get('download_latency')
+        if latency is not None and not cached:
+            self.recorder.observe('download_latency_seconds', latency, response.url, page=page)
+
+    def item_scraped(self, item, response, spider):
+        self.items += 1
+        self.recorder.inc('items_total')
+
+    def spider_closed(self, spider, reason):
+        seconds = max(time.time() - self.recorder.started, 1e-9)
+        self.recorder.gauge('items_per_second', round(self.items / seconds, 3))
+        self.recorder.gauge('pages_per_second', round(self.responses / seconds, 3))
+        self.recorder.save(self.path)
+        spider.logger.info(f"Crawl stats written to {self.path}\n{summary(self.recorder.to_dict())}")
+        if self.profiler is not None:
+            report = self.profiler.dump()
+            if report:
+                spider.logger.info(f"Parse profile ({self.profiler.pages} pages) written to "
+                                   f"{self.profiler.out_path}\n{report}")
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds is not None else '-'
+
+
+def summary(stage):
+    """A few readable lines for one stage of the stats file."""
+    lines = [f"[{stage['stage']}] {stage['seconds']:.1f}s"]
+    for g in stage['gauges']:
+        label = ''.join(f' {k}={v}' for k, v in g['labels'].items())
+        lines.append(f"  {g['name']}{label}: {g['value']}")
+    hists = sorted(stage['histograms'], key=lambda h: -h['sum'])
+    if hists:
+        lines.append(f"  {'metric':<28}{'labels':<30}{'count':>7}{'mean ms':>9}{'p95 ms':>8}{'max ms':>9}")
+    for h in hists:
+        label = ','.join(f'{v}' for v in h['labels'].values())
+        lines.append(f"  {h['name']:<28}{label[:29]:<30}{h['count']:>7}{_ms(h['mean']):>9}"
+                     f"{_ms(h['p95']):>8}{_ms(h['max']):>9}")
+    for s in stage['slow'][:10]:
+        label = ','.join(f'{v}' for v in s['labels'].values())
+        lines.append(f"  slow {s['metric']} {label}: {s['seconds'] * 1000:.0f} ms  {s['key']}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default='crawl_stats.json')
+    args = parser.parse_args()
+    with open(args.file, 'r', encoding='utf-8') as f:
+        stages = json.load(f)['stages']
+    for stage in stages.values():
+        print(summary(stage) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -4,112 +4,196 @@ Also added Clean Process
 ---------------------------------------------------------------------
 import scrapy
 import json
+import logging
+
+from crawl_frontier import Frontier, JsonlSink
+from crawl_stats import timed_parse
+from page_cache import PageStore, response_headers
 
 
 class AnimeDetailSpider(scrapy.Spider):
     name = "anime_detail"
     allowed_domains = ["myanimelist.net"]
 
+    # Only used in concurrent mode; override per run with
+    # -s CONCURRENT_REQUESTS_PER_DOMAIN=16
+    custom_settings = {
+        'CONCURRENT_REQUESTS': 32,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+        # Page cache, off unless -s PAGE_CACHE_MODE=revalidate|replay (see page_cache.py)
+        'DOWNLOADER_MIDDLEWARES': {'page_cache.PageCacheMiddleware': 900},
+        # Timings export, off unless -s CRAWL_STATS_ENABLED=1 (see crawl_stats.py)
+        'EXTENSIONS': {'crawl_stats.CrawlStatsExtension': 500},
+    }
+
+    def __init__(self, mode='chain', window=32, ordered='1', stage='full', raw_dir='rawpages',
+                 frontier=None, out='anime_details.jsonl', max_attempts=3, worker=None, shard=0, lease=300,
+                 data='animedata.json', *args, **kwargs):
+        """
+        Spider arguments (scrapy crawl anime_detail -a mode=concurrent ...):
+        mode    -- 'chain' fetches one page after another (original behaviour),
+                   'concurrent' keeps up to `window` pages in flight at once
+        window  -- size of the in-flight window in concurrent mode
+        ordered -- '1' emits items in animedata.json order, '0' as they arrive
+        stage   -- 'full' parses pages as they arrive, 'download' only stores them
+                   in `raw_dir` for parse_stage.py and yields no items
+        raw_dir -- page store used by the download stage
+        frontier -- SQLite file that records every URL's state (crawl_frontier.py); a
+                   re-run only requests unfinished URLs. Implies mode=concurrent with
+                   ordered=0, and items are appended to `out` as JSON Lines
+        out     -- JSON Lines output of frontier mode
+        max_attempts -- runs that may try a failing URL in frontier mode
+        worker, shard, lease -- set by crawl_coordinator.py when several processes share
+                   one frontier: this process's name, its preferred shard and the seconds
+                   after which its claimed URLs may be taken over
+        data    -- the URL list (animedata.json layout)
+        """
+        super().__init__(*args, **kwargs)
+        self.mode = mode
+        self.window = max(1, int(window))
+        self.ordered = str(ordered).lower() not in ('0', 'false', 'no')
+        if stage not in ('full', 'download'):
+            raise ValueError(f"Unknown stage: {stage}")
+        self.raw_store = PageStore(raw_dir) if stage == 'download' else None
+
+        self.frontier = None
+        self.sink = None
+        if frontier:
+            self.frontier = Frontier(frontier, int(max_attempts), worker, int(shard), float(lease))
+            # The frontier hands out any unfinished URL, so there is no order to keep
+            self.mode = 'concurrent'
+            self.ordered = False
+            # Download stage stores pages and yields no items, only the frontier marks matter
+            self.sink = JsonlSink(out) if self.raw_store is None else None
+
+        self.next_to_schedule = 0
+        self.next_to_release = 0
+        self.in_flight = 0
+        # Reorder buffer: finished items keyed by meta['index'], None for failed pages
+        self.pending_items = {}
+        self.data_file = data
+
     def start_requests(self):
         # Load URLs from the JSON file
-        with open('animedata.json', 'r', encoding='utf-8') as f:
+        with open(self.data_file, 'r', encoding='utf-8') as f:
             self.data = json.load(f)
 
+        if self.frontier is not None:
+            # A shared frontier is seeded by the coordinator
+            added = self.frontier.seed(entry['url'] for entry in self.data) if self.frontier.worker is None else 0
+            requeued = self.frontier.recover(self.sink)
+            counts = self.frontier.counts()
+            logging.info(f"Frontier {self.frontier.path}: {added} new URLs, {requeued} requeued, {counts}")
+
+        if self.mode == 'concurrent':
+            yield from self.fill_window()
+            return
+
         # Start with the first entry
         if self.data:
             first_entry = self.data[0]
             yield scrapy.Request(url=first_entry['url'], callback=self.parse_anime_page, meta={'index': 0})
 
-    def clean_data(self, data):
+    def fill_window(self):
         """
-        Helper function to clean extracted data.
-        Removes empty strings and strips whitespace from lists and strings.
+        Schedule detail requests until the in-flight window is full.
+        In ordered mode the window is measured from the oldest unreleased item,
+        so the reorder buffer never holds more than `window` entries.
         """
-        if isinstance(data, list):
-            return [item.strip() for item in data if item.strip()]
-        elif isinstance(data, str):
-            return data.strip()
+        if self.frontier is not None:
+            for index, url in self.frontier.claim(self.window - self.in_flight):
+                self.in_flight += 1
+                yield scrapy.Request(url=url, callback=self.parse_anime_page, errback=self.handle_failure,
+                                     meta={'index': index}, dont_filter=True)
+            return
+
+        while self.next_to_schedule < len(self.data):
+            if self.ordered:
+                if self.next_to_schedule >= self.next_to_release + self.window:
+                    break
+            elif self.in_flight >= self.window:
+                break
+
+            index = self.next_to_schedule
+            self.next_to_schedule += 1
+            self.in_flight += 1
+            yield scrapy.Request(
+                url=self.data[index]['url'],
+                callback=self.parse_anime_page,
+                errback=self.handle_failure,
+                meta={'index': index},
+                priority=-index,  # lower index first, keeps the reorder buffer short
+                dont_filter=True,  # animedata.json has a few repeated URLs
+            )
+
+    def complete(self, index, item, error=None):
+        """Record a finished page, release whatever is now in order and refill the window."""
+        self.in_flight -= 1
+        if self.frontier is not None:
+            self.record(index, item, error)
+        if self.ordered:
+            self.pending_items[index] = item
+            while self.next_to_release in self.pending_items:
+                ready = self.pending_items.pop(self.next_to_release)
+                self.next_to_release += 1
+                if ready is not None:
+                    yield ready
+        elif item is not None:
+            yield item
+
+        yield from self.fill_window()
+
+    def handle_failure(self, failure):
+        request = failure.request
+        logging.error(f"Error fetching {request.url}: {failure.value}")
+        yield from self.complete(request.meta['index'], None, failure.value)
+
+    def record(self, index, item, error):
+        """Frontier mode: append the item to the sink and mark the URL done (or failed)."""
+        if error is not None:
+            self.frontier.mark_failed(index, error)
         else:
-            return data
+            location = self.sink.write(item) if item is not None and self.sink is not None else None
+            self.frontier.mark_done(index, location)
+        if self.frontier.due():
+            self.frontier.checkpoint(self.sink)
+
+    def extract(self, response, index):
+        """Parse the page, or in the download stage store it under its animedata.json URL."""
+        if self.raw_store is None:
+            return timed_parse(self, response)
+        self.raw_store.put(self.data[index]['url'], response.status, response_headers(response), response.body)
+        self.crawler.stats.inc_value('raw_store/pages')
+        return None
+
+    def closed(self, reason):
+        if self.raw_store is not None:
+            self.raw_store.close()
+        if self.frontier is not None:
+            self.frontier.checkpoint(self.sink)
+            if self.sink is not None:
+                self.sink.close()
+            counts = self.frontier.counts()
+            self.frontier.close()
+            logging.info(f"Frontier after this run: {counts}")
 
     def parse_anime_page(self, response):
         index = response.meta['index']
 
-        # Extract detailed information
-        description = self.clean_data(response.xpath(
-            '//p[@itemprop="description"]/text() | //p[@itemprop="description"]/br/following-sibling::text()').getall())
-        character_names = self.clean_data(
-            response.xpath('//td[@class="borderClass"]/h3[@class="h3_characters_voice_actors"]/a/text()').getall())
-        character_types = self.clean_data(
-            response.xpath('//td[@class="borderClass"]/div[@class="spaceit_pad"]/small/text()').getall())
-        voice_actor_names = self.clean_data(response.xpath('//td[@class="va-t ar pl4 pr4"]/a/text()').getall())
-        languages = self.clean_data(response.xpath('//td[@class="va-t ar pl4 pr4"]/small/text()').getall())
-        character_images = self.clean_data(response.css('div.picSurround img::attr(data-src)').getall())
-        voice_actor_images = self.clean_data(
-            response.css('td.va-t.ar.pl4.pr4 + td div.picSurround img::attr(data-src)').getall())
-
-        statuses = self.clean_data(response.css('div.review-ratio__box a::text').getall())
-        numbers = self.clean_data(response.css('div.review-ratio__box a strong::text').getall())
-
-        synonyms = self.clean_data(
-            response.xpath('//div[@class="spaceit_pad"][contains(., "Synonyms")]/text()').getall())
-        japanese_title = self.clean_data(
-            response.xpath('//div[@class="spaceit_pad"][contains(., "Japanese")]/text()').getall())
-        english_title = self.clean_data(
-            response.xpath('//div[@class="spaceit_pad"][contains(., "English")]/text()').getall())
-        anime_type = self.clean_data(response.css('div.spaceit_pad:contains("Type") a::text').get())
-        episodes = self.clean_data(response.css('div.spaceit_pad:contains("Episodes")::text').getall())
-        status = self.clean_data(response.css('div.spaceit_pad:contains("Status")::text').getall())
-        aired = self.clean_data(response.css('div.spaceit_pad:contains("Aired")::text').getall())
-        premiered = self.clean_data(response.css('div.spaceit_pad:contains("Premiered") a::text').get())
-        broadcast = self.clean_data(response.css('div.spaceit_pad:contains("Broadcast")::text').getall())
-        producers = self.clean_data(response.css('div.spaceit_pad:contains("Producers") a::text').getall())
-        licensors = self.clean_data(response.css('div.spaceit_pad:contains("Licensors") a::text').getall())
-        studios = self.clean_data(response.css('div.spaceit_pad:contains("Studios") a::text').getall())
-        source = self.clean_data(response.css('div.spaceit_pad:contains("Source") a::text').getall())
-        genres = self.clean_data(response.css('div.spaceit_pad:contains("Genres") a::text').getall())
-        themes = self.clean_data(response.css('div.spaceit_pad:contains("Themes") a::text').getall())
-        duration = self.clean_data(response.css('div.spaceit_pad:contains("Duration")::text').getall())
-        rating = self.clean_data(response.css('div.spaceit_pad:contains("Rating")::text').getall())
-        score = self.clean_data(response.css('span[itemprop="ratingValue"]::text').get())
-        ranked = self.clean_data(response.css('div.spaceit_pad:contains("Ranked")::text').getall())
-        popularity = self.clean_data(response.css('div.spaceit_pad:contains("Popularity")::text').getall())
-        members = self.clean_data(response.css('div.spaceit_pad:contains("Members")::text').getall())
-        favorites = self.clean_data(response.css('div.spaceit_pad:contains("Favorites")::text').getall())
-
-        yield {
-            'description': description,
-            'character_names': character_names,
-            'character_types': character_types,
-            'voice_actor_names': voice_actor_names,
-            'languages': languages,
-            'character_images': character_images,
-            'voice_actor_images': voice_actor_images,
-            'statuses': statuses,
-            'numbers': numbers,
-            'synonyms': synonyms,
-            'japanese_title': japanese_title,
-            'english_title': english_title,
-            'anime_type': anime_type,
-            'episodes': episodes,
-            'status': status,
-            'aired': aired,
-            'premiered': premiered,
-            'broadcast': broadcast,
-            'producers': producers,
-            'licensors': licensors,
-            'studios': studios,
-            'source': source,
-            'genres': genres,
-            'themes': themes,
-            'duration': duration,
-            'rating': rating,
-            'score': score,
-            'ranked': ranked,
-            'popularity': popularity,
-            'members': members,
-            'favorites': favorites,
-        }
+        if self.mode == 'concurrent':
+            error = None
+            try:
+                item = self.extract(response, index)
+            except Exception as e:
+                # A lost index would stall the reorder buffer, so release it as failed
+                logging.error(f"Error processing {response.url}: {e}")
+                item, error = None, e
+            yield from self.complete(index, item, error)
+            return
+
+        item = self.extract(response, index)
+        if item is not None:
+            yield item
 # Proceed to the next URL
         next_index = index + 1
         if next_index < len(self.data):
@@ -0,0 +1,208 @@
+"""
+Synthetic MyAnimeList pages.
+
+Builds topanime.php and anime detail pages from the rows in animedata.json,
+using the same markup the selectors in anime.py, detail_data.py and
+mal_parsing.py look for. Used for benchmarks and the local stand-in server,
+so nothing here ever needs the live site.
+"""
+import html
+import random
+import re
+
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Mystery', 'Romance',
+          'Sci-Fi', 'Slice of Life', 'Sports', 'Supernatural', 'Suspense', 'Award Winning']
+THEMES = ['Historical', 'Isekai', 'Military', 'Music', 'Psychological', 'School', 'Time Travel']
+STUDIOS = ['Madhouse', 'Bones', 'Kyoto Animation', 'Wit Studio', 'MAPPA', 'Sunrise', 'Production I.G']
+PRODUCERS = ['Aniplex', 'Dentsu', 'TOHO animation', 'Shueisha', 'Pony Canyon', 'Kadokawa']
+LICENSORS = ['Crunchyroll', 'Aniplex of America', 'Funimation', 'Sentai Filmworks']
+SOURCES = ['Manga', 'Light novel', 'Original', 'Visual novel', 'Web manga']
+LANGUAGES = ['Japanese', 'English', 'German', 'French', 'Spanish', 'Portuguese (BR)']
+REVIEW_STATUSES = ['Recommended', 'Mixed Feelings', 'Not Recommended']
+
+# Rough size of the real pages: navigation, related entries, recommendations...
+FILLER_BLOCKS = 120
+
+
+def anime_id_from_entry(entry, fallback=0):
+    match = re.search(r'/anime/(\d+)', entry.get('url') or '')
+    return int(match.group(1)) if match else fallback
+
+
+def synthetic_entry(index):
+    """A made-up animedata.json row, for page counts beyond the real file."""
+    anime_id = 900000 + index
+    rng = random.Random(anime_id)
+    episodes = rng.choice([1, 12, 13, 24, 25, 26, 50, 64, 148])
+    return {
+        'title': f'Synthetic Anime {index + 1}',
+        'image': f'https://cdn.myanimelist.net/r/50x70/images/anime/{anime_id % 2000}/{anime_id}.jpg',
+        'episodes': f'TV ({episodes} eps)',
+        'airing_dates': 'Apr 2011 - Sep 2011',
+        'members': f'{rng.randint(1000, 3000000):,} members',
+        'score': f'{rng.uniform(6.5, 9.3):.2f}',
+        'url': f'https://myanimelist.net/anime/{anime_id}/Synthetic_Anime_{index + 1}',
+    }
+
+
+def _filler(rng):
+    blocks = []
+    for n in range(FILLER_BLOCKS):
+        blocks.append(
+            f'<div class="related-entries-item"><a href="/anime/{rng.randint(1, 60000)}">'
+            f'<img data-src="https://cdn.myanimelist.net/images/anime/{n}/{rng.randint(1, 99999)}.jpg"></a>'
+            f'<div class="title"><span class="relation">Side Story</span> entry {n}</div></div>'
+        )
+    return '\n'.join(blocks)
+
+
+def _links(names, kind):
+    return ', '.join(f'<a href="/anime/{kind}/{i + 1}/{html.escape(n)}" title="{html.escape(n)}">{html.escape(n)}</a>'
+                     for i, n in enumerate(names))
+
+
+def _info(label, value_html):
+    return f'<div class="spaceit_pad">\n  <span class="dark_text">{label}:</span>\n  {value_html}\n  </div>'
+
+
+def render_detail_page(entry, index=0):
+    """Render an anime detail page for one animedata.json row."""
+    anime_id = anime_id_from_entry(entry, 900000 + index)
+    rng = random.Random(anime_id)
+    title = html.escape(entry.get('title') or f'Anime {anime_id}')
+    eps_match = re.search(r'\((\d+) eps\)', entry.get('episodes') or '')
+    episodes = eps_match.group(1) if eps_match else 'Unknown'
+    members = (entry.get('members') or '0').replace(' members', '')
+    score = entry.get('score') or 'N/A'
+    genres = rng.sample(GENRES, rng.randint(2, 4))
+    themes = rng.sample(THEMES, rng.randint(1, 2))
+
+    characters = []
+    for c in range(rng.randint(6, 10)):
+        role = 'Main' if c < 2 else 'Supporting'
+        vas = []
+        for v in range(rng.randint(1, 3)):
+            va_id = rng.randint(1, 40000)
+            vas.append(
+                f'<tr><td class="va-t ar pl4 pr4"><a href="https://myanimelist.net/people/{va_id}">'
+                f'Seiyuu {va_id}</a><br><small>{LANGUAGES[v]}</small></td>'
+                f'<td valign="top" width="25"><div class="picSurround"><a href="https://myanimelist.net/people/{va_id}">'
+                f'<img data-src="https://cdn.myanimelist.net/r/42x62/images/voiceactors/{va_id % 4}/{va_id}.jpg" '
+                f'class="lazyload"></a></div></td></tr>'
+            )
+        char_id = anime_id * 100 + c
+        characters.append(
+            '<table border="0" cellpadding="0" cellspacing="0" width="100%"><tr>'
+            f'<td valign="top" width="27"><div class="picSurround"><a href="https://myanimelist.net/character/{char_id}">'
+            f'<img data-src="https://cdn.myanimelist.net/r/42x62/images/characters/{char_id % 16}/{char_id}.jpg" '
+            'class="lazyload"></a></div></td>'
+            f'<td valign="top" class="borderClass"><h3 class="h3_characters_voice_actors">'
+            f'<a href="https://myanimelist.net/character/{char_id}">Character {char_id}</a></h3>'
+            f'<div class="spaceit_pad"><small>{role}</small></div></td>'
+            f'<td valign="top" class="borderClass"><table class="js-anime-character-va-lang">{"".join(vas)}</table></td>'
+            '</tr></table>'
+        )
+
+    reviews = ''.join(
+        f'<div class="review-ratio__box"><a href="?filter={i}"><strong>{rng.randint(0, 900)}</strong> {status}</a></div>'
+        for i, status in enumerate(REVIEW_STATUSES)
+    )
+
+    sidebar = '\n'.join([
+        '<h2>Alternative Titles</h2>',
+        _info('Synonyms', f'{title} Alternative'),
+        _info('Japanese', f'{title} (Japanese)'),
+        _info('English', f'{title}: English Edition'),
+        '<h2>Information</h2>',
+        _info('Type', '<a href="https://myanimelist.net/topanime.php?type=tv">TV</a>'),
+        _info('Episodes', episodes),
+        _info('Status', 'Finished Airing'),
+        _info('Aired', entry.get('airing_dates') or 'Not available'),
+        _info('Premiered', '<a href="https://myanimelist.net/anime/season/2023/fall">Fall 2023</a>'),
+        _info('Broadcast', 'Fridays at 23:00 (JST)'),
+        _info('Producers', _links(rng.sample(PRODUCERS, 3), 'producer')),
+        _info('Licensors', _links(rng.sample(LICENSORS, 1), 'producer')),
+        _info('Studios', _links(rng.sample(STUDIOS, 1), 'producer')),
+        _info('Source', f'<a href="/anime.php?source=1">{rng.choice(SOURCES)}</a>'),
+        _info('Genres', ''.join(f'<span itemprop="genre" style="display: none">{g}</span>' for g in genres)
+              + _links(genres, 'genre')),
+        _info('Themes', _links(themes, 'genre')),
+        _info('Duration', '24 min. per ep.'),
+        _info('Rating', 'PG-13 - Teens 13 or older'),
+        '<h2>Statistics</h2>',
+        f'<div class="spaceit_pad po-r js-statistics-info di-ib" data-id="info1"><span class="dark_text">Score:</span> '
+        f'<span itemprop="ratingValue" class="score-label">{score}</span><sup>1</sup> '
+        f'(scored by <span itemprop="ratingCount">{rng.randint(1000, 2000000)}</span> users)</div>',
+        f'<div class="spaceit_pad po-r js-statistics-info di-ib" data-id="info2"><span class="dark_text">Ranked:</span> '
+        f'#{index + 1}<sup>2</sup><div class="statistics-info-info-box"></div></div>',
+        _info('Popularity', f'#{rng.randint(1, 20000)}'),
+        _info('Members', members),
+        _info('Favorites', f'{rng.randint(0, 250000):,}'),
+    ])
+
+    return f'''<!DOCTYPE html>
+<html><head><title>{title} - MyAnimeList.net</title>
+<script type="text/javascript">window.MAL = {{"anime_id": {anime_id}}};</script></head>
+<body class="page-common">
+<div id="headerSmall"><a href="https://myanimelist.net/">MyAnimeList</a></div>
+<div id="contentWrapper"><h1 class="title-name h1_bold_none"><strong>{title}</strong></h1>
+<div id="content"><table border="0" cellpadding="0" cellspacing="0" width="100%"><tr>
+<td class="borderClass" width="225" valign="top"><div class="leftside">
+<div style="text-align: center;"><img data-src="{html.escape(entry.get('image') or '')}" itemprop="image"></div>
+{sidebar}
+</div></td>
+<td valign="top" style="padding-left: 5px;">
+<p itemprop="description">{title} is a synthetic anime.<br>
+<br>
+It exists so the crawler can be measured without the live site.<br>
+<br>
+[Written by MAL Rewrite]</p>
+<div class="detail-characters-list clearfix">{"".join(characters)}</div>
+<div class="review-ratio">{reviews}</div>
+<div class="related-entries">{_filler(rng)}</div>
+</td></tr></table></div></div>
+<div id="footer">MyAnimeList.net</div>
+</body></html>'''
+
+
+def render_top_page(entries, limit):
+    """Render topanime.php?limit=<limit> for the rows starting at that rank."""
+    rows = []
+    for rank, entry in enumerate(entries[limit:limit + 50], start=limit + 1):
+        url = html.escape(entry.get('url') or '')
+        rows.append(f'''<tr class="ranking-list">
+<td class="rank ac" valign="top"><span class="lightLink top-anime-rank-text rank1">{rank}</span></td>
+<td class="title al va-t word-break">
+<a class="hoverinfo_trigger fl-l ml12 mr8" href="{url}"><img data-src="{html.escape(entry.get('image') or '')}" class="lazyload"></a>
+<div class="detail"><div class="di-ib clearfix"><h3 class="fl-l fs14 fw-b anime_ranking_h3"><a href="{url}">{html.escape(entry.get('title') or '')}</a></h3></div>
+<div class="information di-ib mt4">
+        {entry.get('episodes') or ''}<br>
+        {entry.get('airing_dates') or ''}<br>
+        {entry.get('members') or ''}
+      </div></div></td>
+<td class="score ac fs14"><div class="js-top-ranking-score-col di-ib al"><span class="text on score-label score-9">{entry.get('score') or 'N/A'}</span></div></td>
+</tr>''')
+    return f'''<!DOCTYPE html>
+<html><head><title>Top Anime - MyAnimeList.net</title></head>
+<body><div id="content"><table class="top-ranking-table">
+<tr class="table-header"><td class="rank">Rank</td><td class="title">Title</td><td class="score">Score</td></tr>
+{"".join(rows)}
+</table></div></body></html>'''
+
+
+def render_image(path):
+    """
+    Bytes for a cdn.myanimelist.net image path, the same at every /r/WxH/ size, or None.
+    Not a real picture, only a JPEG-framed blob of a realistic size. The first character
+    of every anime gets one shared 'no picture' blob, so the same content turns up
+    under many URLs as it does on the site.
+    """
+    match = re.match(r'(?:/r/\d+x\d+)?(/images/.+\.(?:jpe?g|png|gif|webp))$', path)
+    if not match:
+        return None
+    path = match.group(1)
+    character = re.search(r'/images/characters/\d+/(\d+)\.', path)
+    if character and int(character.group(1)) % 100 == 0:
+        path = '/images/questionmark_23.gif'
+    rng = random.Random(path)
+    return b'\xff\xd8\xff\xe0' + rng.randbytes(rng.randint(4000, 60000)) + b'\xff\xd9'
@@ -0,0 +1,220 @@
+"""
+Shared extraction for MyAnimeList anime detail pages.
+
+Used by AnimeSpider (anime.py) and AnimeDetailSpider (detail_data.py).
+Keep this file next to scrapy.cfg (or anywhere on the path) so both spiders can import it.
+
+The old spiders ran one `div.spaceit_pad:contains(...)` query per field, and each one
+rescanned the whole page. Here the sidebar and the characters/voice actors table are
+walked once and every node is dispatched on its label ("Type:", "Episodes:", ...).
+"""
+import re
+import time
+
+SPACEIT_PAD = '//div[contains(concat(" ", normalize-space(@class), " "), " spaceit_pad ")]'
+CHARACTER_CELLS = '//td[@class="borderClass" or contains(@class, "va-t")]'
+
+# Sidebar label -> (item key, what to read from the div)
+#   'text'  -> the div's own text nodes, e.g. "Episodes: 28"
+#   'links' -> text of every link inside the div, e.g. the list of genres
+#   'link'  -> text of the first link only
+# Alternative titles only ever matched divs whose class is exactly "spaceit_pad".
+SIDEBAR_FIELDS = {
+    'Synonyms': ('synonyms', 'text'),
+    'Japanese': ('japanese_title', 'text'),
+    'English': ('english_title', 'text'),
+    'Type': ('anime_type', 'link'),
+    'Episodes': ('episodes', 'text'),
+    'Status': ('status', 'text'),
+    'Aired': ('aired', 'text'),
+    'Premiered': ('premiered', 'link'),
+    'Broadcast': ('broadcast', 'text'),
+    'Producers': ('producers', 'links'),
+    'Licensors': ('licensors', 'links'),
+    'Studios': ('studios', 'links'),
+    'Source': ('source', 'links'),
+    'Genres': ('genres', 'links'),
+    'Themes': ('themes', 'links'),
+    'Duration': ('duration', 'text'),
+    'Rating': ('rating', 'text'),
+    'Ranked': ('ranked', 'text'),
+    'Popularity': ('popularity', 'text'),
+    'Members': ('members', 'text'),
+    'Favorites': ('favorites', 'text'),
+}
+EXACT_CLASS_LABELS = {'Synonyms', 'Japanese', 'English'}
+
+# Key order of the item detail_data.py has always produced
+ITEM_KEYS = [
+    'description', 'character_names', 'character_types', 'voice_actor_names', 'languages',
+    'character_images', 'voice_actor_images', 'statuses', 'numbers', 'synonyms',
+    'japanese_title', 'english_title', 'anime_type', 'episodes', 'status', 'aired',
+    'premiered', 'broadcast', 'producers', 'licensors', 'studios', 'source', 'genres',
+    'themes', 'duration', 'rating', 'score', 'ranked', 'popularity', 'members', 'favorites',
+]
+
+
+def clean_data(data):
+    """
+    Helper function to clean extracted data.
+    Removes empty strings and strips whitespace from lists and strings.
+    """
+    if isinstance(data, list):
+        return [item.strip() for item in data if item.strip()]
+    elif isinstance(data, str):
+        return data.strip()
+    else:
+        return data
+
+
+def anime_id_from_url(url):
+    """MAL anime id from a detail URL (https://myanimelist.net/anime/52991/...), or None."""
+    match = re.search(r'/anime/(\d+)', url or '')
+    return int(match.group(1)) if match else None
+
+
+def canonical_anime_url(url):
+    """
+    One URL per anime, https://myanimelist.net/anime/<id>/<slug>, whatever scheme, host,
+    query, fragment or trailing slash the link had. URLs without an anime id come back as they are.
+    """
+    match = re.search(r'/anime/(\d+)(/[^/?#]*)?', url or '')
+    if not match:
+        return url
+    slug = (match.group(2) or '').rstrip('/')
+    return f'https://myanimelist.net/anime/{match.group(1)}{slug}'
+
+
+def own_text(element):
+    """Text nodes directly under an lxml element, same as `::text` / `text()`."""
+    texts = [element.text] if element.text is not None else []
+    texts.extend(child.tail for child in element if child.tail is not None)
+    return texts
+
+
+def has_class(element, name):
+    return name in (element.get('class') or '').split()
+
+
+def parse_sidebar(response):
+    """One pass over the spaceit_pad divs, returns {item key: raw value}."""
+    raw = {}
+    for node in response.xpath(SPACEIT_PAD):
+        div = node.root
+        label = None
+        for child in div:
+            if child.tag == 'span' and child.get('class') == 'dark_text':
+                label = ''.join(own_text(child)).strip().rstrip(':')
+                break
+        field = SIDEBAR_FIELDS.get(label)
+        if field is None:
+            continue
+        if label in EXACT_CLASS_LABELS and div.get('class') != 'spaceit_pad':
+            continue
+
+        key, kind = field
+        if kind == 'text':
+            raw.setdefault(key, []).extend(own_text(div))
+            continue
+
+        link_texts = []
+        for link in div.iter('a'):
+            link_texts.extend(own_text(link))
+        if kind == 'links':
+            raw.setdefault(key, []).extend(link_texts)
+        elif raw.get(key) is None and link_texts:
+            raw[key] = link_texts[0]
+    return raw
+
+
+def parse_characters(response):
+    """One pass over the characters / voice actors table."""
+    raw = {'character_names': [], 'character_types': [], 'voice_actor_names': [],
+           'languages': [], 'voice_actor_images': []}
+    for node in response.xpath(CHARACTER_CELLS):
+        td = node.root
+        css_class = td.get('class')
+        if css_class == 'borderClass':
+            for child in td:
+                if child.tag == 'h3' and child.get('class') == 'h3_characters_voice_actors':
+                    for link in child:
+                        if link.tag == 'a':
+                            raw['character_names'].extend(own_text(link))
+                elif child.tag == 'div' and child.get('class') == 'spaceit_pad':
+                    for small in child:
+                        if small.tag == 'small':
+                            raw['character_types'].extend(own_text(small))
+            continue
+
+        if css_class == 'va-t ar pl4 pr4':
+            for child in td:
+                if child.tag == 'a':
+                    raw['voice_actor_names'].extend(own_text(child))
+                elif child.tag == 'small':
+                    raw['languages'].extend(own_text(child))
+
+        if all(has_class(td, name) for name in ('va-t', 'ar', 'pl4', 'pr4')):
+            picture_cell = td.getnext()
+            while picture_cell is not None and not isinstance(picture_cell.tag, str):
+                picture_cell = picture_cell.getnext()  # skip comments
+            if picture_cell is not None and picture_cell.tag == 'td':
+                for div in picture_cell.iter('div'):
+                    if has_class(div, 'picSurround'):
+                        raw['voice_actor_images'].extend(
+                            img.get('data-src') for img in div.iter('img') if img.get('data-src') is not None)
+    return raw
+
+
+def parse_description(response):
+    return {'description': response.xpath(
+        '//p[@itemprop="description"]/text() | //p[@itemprop="description"]/br/following-sibling::text()').getall()}
+
+
+def parse_character_images(response):
+    return {'character_images': response.css('div.picSurround img::attr(data-src)').getall()}
+
+
+def parse_reviews(response):
+    return {'statuses': response.css('div.review-ratio__box a::text').getall(),
+            'numbers': response.css('div.review-ratio__box a strong::text').getall()}
+
+
+def parse_score(response):
+    return {'score': response.css('span[itemprop="ratingValue"]::text').get()}
+
+
+# Extraction steps in the order they run; crawl_stats.py times each one by name
+DETAIL_STEPS = [
+    ('sidebar', parse_sidebar),
+    ('characters', parse_characters),
+    ('description', parse_description),
+    ('character_images', parse_character_images),
+    ('reviews', parse_reviews),
+    ('score', parse_score),
+]
+
+
+def parse_detail_page(response, timings=None):
+    """
+    Extract every field of an anime detail page.
+    Returns the dict detail_data.py yields, keys in ITEM_KEYS order.
+    Pass a dict as `timings` to get the seconds spent in each DETAIL_STEPS step.
+    """
+    raw = {}
+    for step, extract in DETAIL_STEPS:
+        if timings is None:
+            raw.update(extract(response))
+            continue
+        start = time.perf_counter()
+        raw.update(extract(response))
+        timings[step] = time.perf_counter() - start
+
+    item = {}
+    for key in ITEM_KEYS:
+        if key in raw:
+            item[key] = clean_data(raw[key])
+        elif key in ('anime_type', 'premiered'):
+            item[key] = None
+        else:
+            item[key] = []
+    return item
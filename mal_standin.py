@@ -0,0 +1,287 @@
+"""
+Local stand-in for myanimelist.net.
+
+Serves topanime.php?limit=N and /anime/<id>/<slug> pages synthesized by mal_pages.py
+from the rows in animedata.json (plus made-up rows past the end of the file), with
+ETag / Last-Modified and 304 support, an optional artificial latency, optional
+rate limiting (429 with Retry-After once clients go faster than --rate-limit req/s)
+and optional random failures (503 for --error-rate of the requests). Pages recorded
+by a crawl with the page cache (page_cache.py) are served as recorded with --recorded.
+cdn.myanimelist.net image paths get stand-in image bytes (for anime_images.py).
+
+    python mal_standin.py --port 8800 --latency 0.05 --rate-limit 5
+    python mal_standin.py --recorded pagecache --error-rate 0.02
+
+Point a crawl at it with StandInDownloadHandler; the spiders keep seeing the real
+https://myanimelist.net URLs, only the transport goes to the local server:
+
+    scrapy crawl anime_detail -s MAL_STANDIN_URL=http://127.0.0.1:8800 \
+        -s DOWNLOAD_HANDLERS='{"https": "mal_standin.StandInDownloadHandler"}'
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+
+from mal_pages import anime_id_from_entry, render_detail_page, render_image, render_top_page, synthetic_entry
+
+IMAGE_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+               '.webp': 'image/webp'}
+
+
+class StandInSite:
+    """The pages the stand-in serves, plus counters the tests and benchmarks read."""
+
+    def __init__(self, entries, page_count=None, latency=0.0, rate_limit=None, retry_after=1,
+                 error_rate=0.0, recorded=None, seed=0):
+        entries = list(entries)
+        if page_count is not None:
+            entries = entries[:page_count] + [synthetic_entry(i) for i in range(len(entries), page_count)]
+        self.entries = entries
+        self.latency = latency
+        self.by_id = {}
+        for index, entry in enumerate(entries):
+            self.by_id.setdefault(anime_id_from_entry(entry, 900000 + index), (index, entry))
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self.counters = {'requests': 0, 'ok': 0, 'not_modified': 0, 'not_found': 0, 'rate_limited': 0,
+                         'errors': 0, 'recorded': 0}
+        self.lock = threading.Lock()
+        self.page_cache = {}
+        # Token bucket: rate_limit requests per second, bursts up to one second's worth
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.tokens = float(rate_limit or 0)
+        self.refilled_at = time.monotonic()
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        # Page store of a real crawl; sqlite connections stay in their thread, so one per server thread
+        self.recorded = recorded
+        self.stores = threading.local()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def allow(self):
+        """Take a token for one request; False means answer 429."""
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(self.rate_limit), self.tokens + (now - self.refilled_at) * self.rate_limit)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def fail(self):
+        """True for the requests that get a 503, error_rate of them."""
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def recorded_page(self, path, query):
+        """The body a page-cached crawl stored for this page, or None."""
+        if not getattr(self.stores, 'store', None):
+            from page_cache import PageStore
+            self.stores.store = PageStore(self.recorded)
+        url = f'https://myanimelist.net{path}' + (f'?{urlencode(query, doseq=True)}' if query else '')
+        entry = self.stores.store.get(url)
+        if entry is None or entry['status'] != 200:
+            return None
+        self.count('recorded')
+        return entry['body']
+
+    def render(self, path, query):
+        """Return the page body for a path, or None for a 404."""
+        key = (path, query.get('limit', [''])[0])
+        if key in self.page_cache:
+            return self.page_cache[key]
+
+        body = self.recorded_page(path, query) if self.recorded else None
+        if body is not None:
+            self.page_cache[key] = body
+            return body
+        if path.startswith(('/images/', '/r/')):
+            # Cheap to make again, and too many to keep in memory
+            return render_image(path)
+        if path == '/topanime.php':
+            limit = int(query.get('limit', ['0'])[0] or 0)
+            body = render_top_page(self.entries, limit)
+        else:
+            match = re.match(r'/anime/(\d+)', path)
+            if match and int(match.group(1)) in self.by_id:
+                index, entry = self.by_id[int(match.group(1))]
+                body = render_detail_page(entry, index)
+        if body is not None:
+            body = body.encode('utf-8')
+        self.page_cache[key] = body
+        return body
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    site = None  # set by make_server
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        site = self.site
+        site.count('requests')
+        if not site.allow():
+            site.count('rate_limited')
+            self.send_plain(429, b'Too Many Requests', {'Retry-After': str(site.retry_after)})
+            return
+        if site.fail():
+            site.count('errors')
+            self.send_plain(503, b'Service Unavailable')
+            return
+        if site.latency:
+            time.sleep(site.latency)
+
+        url = urlparse(self.path)
+        body = site.render(url.path, parse_qs(url.query))
+        if body is None:
+            site.count('not_found')
+            self.send_plain(404, b'Not Found')
+            return
+
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag or (
+                not self.headers.get('If-None-Match')
+                and self.headers.get('If-Modified-Since') == site.last_modified):
+            site.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', site.last_modified)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        site.count('ok')
+        self.send_response(200)
+        content_type = IMAGE_TYPES.get(os.path.splitext(url.path)[1].lower(), 'text/html; charset=utf-8')
+        self.send_header('Content-Type', content_type)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', site.last_modified)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_plain(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Crawlers that get killed mid-response (crawl_coordinator.py tests) are not errors here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(site, host='127.0.0.1', port=0):
+    """Start the stand-in in a background thread. Returns the server, its URL is server.url."""
+    handler = type('BoundStandInHandler', (StandInHandler,), {'site': site})
+    server = StandInServer((host, port), handler)
+    server.daemon_threads = True
+    server.url = f'http://{host}:{server.server_port}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_entries(data_file='animedata.json'):
+    with open(data_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class StandInDownloadHandler(HTTP11DownloadHandler):
+    """
+    Sends myanimelist.net requests to MAL_STANDIN_URL instead.
+    The response keeps the original URL so spiders, caches and offsite checks are unaffected.
+    """
+
+    def __init__(self, settings, crawler):
+        super().__init__(settings, crawler)
+        self.standin_url = (settings.get('MAL_STANDIN_URL') or '').rstrip('/')
+
+    def download_request(self, request, spider):
+        url = urlparse(request.url)
+        if not self.standin_url or not url.netloc.endswith('myanimelist.net'):
+            return super().download_request(request, spider)
+
+        local_url = self.standin_url + url.path + (f'?{url.query}' if url.query else '')
+        local_request = request.replace(url=local_url)
+
+        def restore(response):
+            # replace() copied meta, so hand back what the real handler sets on the request
+            if 'download_latency' in local_request.meta:
+                request.meta['download_latency'] = local_request.meta['download_latency']
+            return response.replace(url=request.url)
+
+        deferred = super().download_request(local_request, spider)
+        deferred.addCallback(restore)
+        return deferred
+
+
+def standin_settings(server_url):
+    """Settings that route a crawl to a running stand-in server."""
+    return {
+        'MAL_STANDIN_URL': server_url,
+        'DOWNLOAD_HANDLERS': {
+            'https': 'mal_standin.StandInDownloadHandler',
+            'http': 'mal_standin.StandInDownloadHandler',
+        },
+        'ROBOTSTXT_OBEY': False,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve synthetic MyAnimeList pages locally')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--data', default='animedata.json')
+    parser.add_argument('--pages', type=int, help='number of anime to serve (default: all rows in --data)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--rate-limit', type=float, help='requests per second before answering 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--recorded', metavar='DIR',
+                        help='serve the pages stored in this page cache (page_cache.py) where it has them')
+    args = parser.parse_args()
+
+    site = StandInSite(load_entries(args.data), page_count=args.pages, latency=args.latency,
+                       rate_limit=args.rate_limit, retry_after=args.retry_after,
+                       error_rate=args.error_rate, recorded=args.recorded)
+    server = make_server(site, args.host, args.port)
+    print(f"Serving {len(site.entries)} anime at {server.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\nRequests: {site.counters}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+On-disk page cache for the MyAnimeList spiders.
+
+Pages are stored gzip-compressed and content-addressed (sha256 of the body), so a page
+that did not change is written only once. A small SQLite index maps each canonical URL
+to its body, status, headers, ETag/Last-Modified and the time it was stored.
+
+Modes (scrapy crawl ... -s PAGE_CACHE_MODE=<mode>):
+    off         -- default, the spiders go to the network as before
+    revalidate  -- fresh pages come from disk; stale ones are re-requested with
+                   If-None-Match / If-Modified-Since and a 304 reuses the stored copy
+    replay      -- never touch the network, pages missing from the cache are skipped
+
+Other settings:
+    PAGE_CACHE_DIR  -- where the cache lives (default 'pagecache')
+    PAGE_CACHE_TTL  -- seconds a page stays fresh (default one week)
+    PAGE_CACHE_TTLS -- per-path overrides, e.g. {'/topanime.php': 86400}
+
+Both spiders enable PageCacheMiddleware in custom_settings.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from w3lib.url import canonicalize_url
+
+DEFAULT_TTL = 7 * 24 * 3600
+# The ranking pages move every day, detail pages much less
+DEFAULT_TTLS = {'/topanime.php': 24 * 3600}
+
+
+def canonical_url(url):
+    """Cache key: sorted query arguments, no fragment, normalised escaping."""
+    return canonicalize_url(url, keep_fragments=False)
+
+
+class PageStore:
+    """Compressed, content-addressed page store keyed by canonical URL."""
+
+    COMMIT_EVERY = 50
+
+    def __init__(self, cache_dir='pagecache'):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / 'blobs'
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.cache_dir / 'index.db')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            status INTEGER,
+            headers TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            stored_at REAL
+        )
+        ''')
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def blob_path(self, digest):
+        # Two levels of sharding keep directories small: blobs/ab/cd/abcd....gz
+        return self.blob_dir / digest[:2] / digest[2:4] / f'{digest}.gz'
+
+    def get(self, url):
+        """Return the stored entry for `url` (body included) or None."""
+        row = self.conn.execute(
+            'SELECT url, digest, status, headers, etag, last_modified, stored_at FROM pages WHERE url = ?',
+            (canonical_url(url),)).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(row[1])
+        if not path.exists():
+            return None
+        return {
+            'url': row[0],
+            'digest': row[1],
+            'status': row[2],
+            'headers': json.loads(row[3]) if row[3] else {},
+            'etag': row[4],
+            'last_modified': row[5],
+            'stored_at': row[6],
+            'body': gzip.decompress(path.read_bytes()),
+        }
+
+    def put(self, url, status, headers, body, stored_at=None):
+        """Store a page. `headers` is a {name: [values]} dict of str."""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix('.tmp')
+            tmp.write_bytes(gzip.compress(body, compresslevel=6))
+            os.replace(tmp, path)
+
+        lowered = {name.lower(): values for name, values in headers.items()}
+        self.conn.execute('''
+        INSERT OR REPLACE INTO pages (url, digest, status, headers, etag, last_modified, stored_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            canonical_url(url), digest, status, json.dumps(headers),
+            (lowered.get('etag') or [None])[0],
+            (lowered.get('last-modified') or [None])[0],
+            stored_at if stored_at is not None else time.time(),
+        ))
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.commit()
+        return digest
+
+    def touch(self, url):
+        """Mark the stored copy as fresh again after a 304."""
+        self.conn.execute('UPDATE pages SET stored_at = ? WHERE url = ?', (time.time(), canonical_url(url)))
+        self.uncommitted += 1
+
+    def urls(self):
+        return [row[0] for row in self.conn.execute('SELECT url FROM pages ORDER BY url')]
+
+    def stats(self):
+        entries, unique = self.conn.execute('SELECT COUNT(*), COUNT(DISTINCT digest) FROM pages').fetchone()
+        blobs = list(self.blob_dir.rglob('*.gz'))
+        return {
+            'entries': entries,
+            'unique_bodies': unique,
+            'blobs_on_disk': len(blobs),
+            'bytes_on_disk': sum(p.stat().st_size for p in blobs),
+        }
+
+    def gc(self):
+        """Delete blobs no URL points to any more. Returns the number removed."""
+        live = {row[0] for row in self.conn.execute('SELECT DISTINCT digest FROM pages')}
+        removed = 0
+        for path in self.blob_dir.rglob('*.gz'):
+            if path.name[:-3] not in live:
+                path.unlink()
+                removed += 1
+        return removed
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def response_headers(response):
+    return {name.decode('latin-1'): [v.decode('latin-1') for v in values]
+            for name, values in response.headers.items()}
+
+
+class PageCacheStorage:
+    """HTTPCACHE_STORAGE backed by PageStore."""
+
+    def __init__(self, settings):
+        self.cache_dir = settings.get('PAGE_CACHE_DIR', 'pagecache')
+        self.store = None
+
+    def open_spider(self, spider):
+        self.store = PageStore(self.cache_dir)
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def retrieve_response(self, spider, request):
+        entry = self.store.get(request.url)
+        if entry is None:
+            return None
+        # The policy needs the age of the copy to decide whether to revalidate
+        request.meta['page_cache_stored_at'] = entry['stored_at']
+        headers = Headers({name: values for name, values in entry['headers'].items()})
+        respcls = responsetypes.from_args(headers=headers, url=request.url, body=entry['body'])
+        return respcls(url=request.url, headers=headers, status=entry['status'], body=entry['body'])
+
+    def store_response(self, spider, request, response):
+        self.store.put(request.url, response.status, response_headers(response), response.body)
+
+
+class PageCachePolicy:
+    """TTL freshness with ETag / Last-Modified revalidation once a page goes stale."""
+
+    def __init__(self, settings):
+        self.mode = settings.get('PAGE_CACHE_MODE', 'off')
+        self.ttl = settings.getint('PAGE_CACHE_TTL', DEFAULT_TTL)
+        self.ttls = settings.getdict('PAGE_CACHE_TTLS', DEFAULT_TTLS)
+
+    def ttl_for(self, url):
+        path = urlparse(url).path
+        for prefix, ttl in self.ttls.items():
+            if path.startswith(prefix):
+                return int(ttl)
+        return self.ttl
+
+    def should_cache_request(self, request):
+        return request.method == 'GET' and urlparse(request.url).scheme in ('http', 'https')
+
+    def should_cache_response(self, response, request):
+        return response.status == 200
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if self.mode == 'replay':
+            return True
+        stored_at = request.meta.get('page_cache_stored_at') or 0
+        if time.time() - stored_at < self.ttl_for(request.url):
+            return True
+
+        # Stale: ask the server whether our copy is still good
+        etag = cachedresponse.headers.get(b'ETag')
+        last_modified = cachedresponse.headers.get(b'Last-Modified')
+        if etag:
+            request.headers[b'If-None-Match'] = etag
+        if last_modified:
+            request.headers[b'If-Modified-Since'] = last_modified
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return response.status == 304
+
+
+class PageCacheMiddleware(HttpCacheMiddleware):
+    """Scrapy's cache middleware driven by PAGE_CACHE_MODE instead of HTTPCACHE_ENABLED."""
+
+    def __init__(self, settings, stats):
+        mode = settings.get('PAGE_CACHE_MODE', 'off')
+        if mode == 'off':
+            raise NotConfigured
+        if mode not in ('revalidate', 'replay'):
+            raise ValueError(f"Unknown PAGE_CACHE_MODE: {mode}")
+        self.policy = PageCachePolicy(settings)
+        self.storage = PageCacheStorage(settings)
+        # Replay never goes to the network: a miss is dropped instead of downloaded
+        self.ignore_missing = mode == 'replay'
+        self.stats = stats
+
+    def process_response(self, request, response, spider=None):
+        not_modified = 'cached_response' in request.meta and response.status == 304
+        response = super().process_response(request, response, spider)
+        if not_modified:
+            # The stored copy is good for another TTL
+            self.storage.store.touch(request.url)
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or clean the page cache')
+    parser.add_argument('command', choices=['stats', 'gc', 'urls'])
+    parser.add_argument('--dir', default='pagecache')
+    args = parser.parse_args()
+
+    store = PageStore(args.dir)
+    try:
+        if args.command == 'stats':
+            for key, value in store.stats().items():
+                print(f"{key}: {value}")
+        elif args.command == 'gc':
+            print(f"Removed {store.gc()} unreferenced pages")
+        else:
+            for url in store.urls():
+                print(url)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
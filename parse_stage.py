@@ -0,0 +1,166 @@
+"""
+Parse stage for the detail crawl.
+
+    scrapy crawl anime_detail -a mode=concurrent -a stage=download -a raw_dir=rawpages
+
+only downloads and stores the pages (detail_data.py). This script then parses the
+stored pages on several cores with the same extraction code (mal_parsing.py) and
+streams the items out in animedata.json order, so downloads never wait for parsing
+and the parse can be re-run on the stored HTML without touching the network.
+
+    python parse_stage.py --raw-dir rawpages -o anime.json --workers 4
+    python parse_stage.py --bench 1 2 4 8 --synthetic 2000     # pages/s per worker count
+
+-o anime.json writes a JSON array like scrapy's -o; any other name gets JSON Lines.
+Both load with animetodb.py.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from scrapy.http import Headers, HtmlResponse
+
+from mal_pages import render_detail_page, synthetic_entry
+from mal_parsing import parse_detail_page
+from page_cache import PageStore
+
+store = None  # opened once per worker process by init_worker
+
+
+def init_worker(raw_dir):
+    global store
+    store = PageStore(raw_dir)
+
+
+def parse_stored(url):
+    """Worker: (url, item, error). The page is read here, so only the URL and the item cross processes."""
+    entry = store.get(url)
+    if entry is None:
+        return url, None, 'not in the page store'
+    response = HtmlResponse(url=url, status=entry['status'], headers=Headers(entry['headers']), body=entry['body'])
+    try:
+        return url, parse_detail_page(response), None
+    except Exception as e:
+        return url, None, f'{type(e).__name__}: {e}'
+
+
+def parse_pages(urls, raw_dir, workers, chunksize=8):
+    """Yield (url, item, error) for every URL in order, parsed by `workers` processes (0 = in this process)."""
+    if workers <= 0:
+        init_worker(raw_dir)
+        yield from map(parse_stored, urls)
+        return
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(raw_dir,)) as pool:
+        # imap keeps input order while workers run ahead
+        yield from pool.imap(parse_stored, urls, chunksize=chunksize)
+
+
+def read_urls(data_file):
+    with open(data_file, 'r', encoding='utf-8') as f:
+        return [entry['url'] for entry in json.load(f)]
+
+
+class ItemWriter:
+    """Streams items to a JSON array (*.json, same layout as scrapy -o) or to JSON Lines."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.array = path.endswith('.json')
+        self.count = 0
+        if self.array:
+            self.file.write('[')
+
+    def write(self, item):
+        line = json.dumps(item, ensure_ascii=False)
+        if self.array:
+            self.file.write((',\n' if self.count else '\n') + line)
+        else:
+            self.file.write(line + '\n')
+        self.count += 1
+
+    def close(self):
+        if self.array:
+            self.file.write('\n]')
+        self.file.close()
+
+
+def fill_synthetic_store(raw_dir, count, data_file='animedata.json'):
+    """Store `count` pages built by mal_pages.py, for benchmarking without a crawl. Returns their URLs."""
+    try:
+        with open(data_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        entries = []
+    page_store = PageStore(raw_dir)
+    urls = []
+    for i in range(count):
+        entry = entries[i] if i < len(entries) else synthetic_entry(i)
+        body = render_detail_page(entry, i).encode('utf-8')
+        page_store.put(entry['url'], 200, {'Content-Type': ['text/html; charset=utf-8']}, body)
+        urls.append(entry['url'])
+    page_store.close()
+    return urls
+
+
+def run(urls, raw_dir, output, workers, chunksize):
+    writer = ItemWriter(output)
+    failed = 0
+    start = time.perf_counter()
+    try:
+        for url, item, error in parse_pages(urls, raw_dir, workers, chunksize):
+            if item is None:
+                failed += 1
+                print(f"Skipped {url}: {error}", file=sys.stderr)
+                continue
+            writer.write(item)
+    finally:
+        writer.close()
+    seconds = time.perf_counter() - start
+    print(f"Parsed {writer.count} pages into {output} with {workers} workers in {seconds:.2f}s "
+          f"({writer.count / seconds if seconds else 0:.1f} pages/s), {failed} skipped")
+
+
+def bench(urls, raw_dir, worker_counts, chunksize):
+    print(f"{len(urls)} stored pages, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'seconds':>10}{'pages/s':>10}{'scaling':>9}")
+    base = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        parsed = sum(1 for _, item, _ in parse_pages(urls, raw_dir, workers, chunksize) if item is not None)
+        seconds = time.perf_counter() - start
+        rate = parsed / seconds if seconds else 0.0
+        base = base or rate
+        print(f"{workers:>8}{seconds:>10.2f}{rate:>10.1f}{rate / base if base else 0:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--raw-dir', default='rawpages', help='page store written by -a stage=download')
+    parser.add_argument('--data', default='animedata.json', help='URL list, items come out in this order')
+    parser.add_argument('-o', '--output', default='anime_details.jsonl')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='parse processes, 0 = no pool')
+    parser.add_argument('--chunksize', type=int, default=8, help='pages handed to a worker at a time')
+    parser.add_argument('--bench', type=int, nargs='+', metavar='N', help='report pages/s for these worker counts')
+    parser.add_argument('--synthetic', type=int, metavar='PAGES',
+                        help='benchmark on PAGES pages from mal_pages.py in a temporary store')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as tmp:
+            urls = fill_synthetic_store(tmp, args.synthetic, args.data)
+            bench(urls, tmp, args.bench or [1, 2, 4], args.chunksize)
+        return
+
+    urls = read_urls(args.data)
+    if args.bench:
+        bench(urls, args.raw_dir, args.bench, args.chunksize)
+    else:
+        run(urls, args.raw_dir, args.output, args.workers, args.chunksize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Incremental re-crawl support for AnimeSpider (anime.py).
+
+The ranking pages already tell us each title's rank, score and members. This module
+compares those rows with the last snapshot (animedata.json, a snapshot written by a
+previous run, or the anime table in animelist.db) and decides which detail pages
+actually need fetching:
+
+    new        -- not in the previous snapshot
+    changed    -- score, members or rank moved beyond the thresholds
+    unchanged  -- everything else; its previous detail item is carried forward
+
+Rows that were not re-fetched keep their old snapshot values, so small nightly drifts
+add up until they cross a threshold instead of being forgotten.
+"""
+import json
+import re
+import sqlite3
+
+from mal_parsing import anime_id_from_url
+
+
+def parse_number(text):
+    """'988,459 members' -> 988459, '#12' -> 12, anything else -> None."""
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return int(text)
+    match = re.search(r'\d[\d,]*', str(text))
+    return int(match.group().replace(',', '')) if match else None
+
+
+def parse_score(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def first(value):
+    """Detail items store most fields as one-element lists."""
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def row_keys(row):
+    """Lookup keys for a row: MAL id when the URL has one, the title otherwise."""
+    keys = []
+    anime_id = anime_id_from_url(row.get('url'))
+    if anime_id is not None:
+        keys.append(('id', anime_id))
+    if row.get('title'):
+        keys.append(('title', row['title']))
+    return keys
+
+
+def read_json_items(path):
+    """Items from a JSON array (nested arrays flattened) or a JSON Lines file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    items = []
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(reversed(value))
+        elif isinstance(value, dict):
+            items.append(value)
+    return items
+
+
+def load_snapshot(path):
+    """
+    Previous ranking rows as a list of {'title', 'url', 'rank', 'score', 'members'}.
+    Accepts animedata.json, a snapshot written by RankingDelta.save_snapshot, or animelist.db.
+    """
+    if str(path).endswith('.db'):
+        conn = sqlite3.connect(path)
+        try:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(anime)')}
+            # Databases loaded before the mal_id column have no id to build a URL from
+            mal_id = 'mal_id' if 'mal_id' in columns else 'NULL'
+            rows = conn.execute(f'SELECT title, score, ranked, members, {mal_id} FROM anime').fetchall()
+        finally:
+            conn.close()
+        return [{'title': title, 'url': f'https://myanimelist.net/anime/{anime_id}' if anime_id is not None else None,
+                 'score': score, 'rank': parse_number(ranked), 'members': parse_number(members)}
+                for title, score, ranked, members, anime_id in rows]
+
+    snapshot = []
+    for position, row in enumerate(read_json_items(path)):
+        snapshot.append({
+            'title': row.get('title'),
+            'url': row.get('url'),
+            'score': parse_score(row.get('score')),
+            # animedata.json has no rank column, its rows are in rank order
+            'rank': parse_number(row.get('rank')) or position + 1,
+            'members': parse_number(row.get('members')),
+        })
+    return snapshot
+
+
+class RankingDelta:
+    def __init__(self, previous=None, carry=None, score_threshold=0.01,
+                 members_threshold=0.05, rank_threshold=10):
+        """
+        previous          -- snapshot file or animelist.db, None means everything is new
+        carry             -- previous detail output (JSON or JSON Lines) to re-emit for unchanged titles
+        score_threshold   -- absolute score change that triggers a re-fetch
+        members_threshold -- relative members change (0.05 = 5%)
+        rank_threshold    -- number of places a title may move
+        """
+        self.score_threshold = score_threshold
+        self.members_threshold = members_threshold
+        self.rank_threshold = rank_threshold
+
+        self.previous = {}
+        if previous:
+            for row in load_snapshot(previous):
+                for key in row_keys(row):
+                    self.previous.setdefault(key, row)
+
+        self.carry = {}
+        if carry:
+            for item in read_json_items(carry):
+                for key in row_keys(item):
+                    self.carry.setdefault(key, item)
+
+        self.current = []
+        self.counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'carried': 0, 'refetch_no_carry': 0}
+
+    def find(self, lookup, row):
+        for key in row_keys(row):
+            if key in lookup:
+                return lookup[key]
+        return None
+
+    def moved(self, old, new):
+        if old['score'] is not None and new['score'] is not None:
+            # MAL scores have two decimals; compare hundredths so 9.10 vs 9.09 counts as 0.01
+            if round(abs(new['score'] - old['score']) * 100) >= round(self.score_threshold * 100):
+                return True
+        if old['members'] and new['members'] is not None:
+            if abs(new['members'] - old['members']) / old['members'] >= self.members_threshold:
+                return True
+        if old['rank'] is not None and new['rank'] is not None:
+            if abs(new['rank'] - old['rank']) >= self.rank_threshold:
+                return True
+        return False
+
+    def classify(self, title, url, score, members, rank):
+        """Return 'new', 'changed' or 'unchanged' for one ranking row and remember it for the next snapshot."""
+        row = {'title': title, 'url': url, 'score': parse_score(score),
+               'members': parse_number(members), 'rank': parse_number(rank)}
+        old = self.find(self.previous, row)
+        if old is None:
+            status = 'new'
+        elif self.moved(old, row):
+            status = 'changed'
+        else:
+            status = 'unchanged'
+            # Keep measuring against the values we last fetched
+            row = dict(row, score=old['score'], members=old['members'], rank=old['rank'])
+        self.current.append(row)
+        self.counts[status] += 1
+        return status
+
+    def carried_item(self, title, url):
+        """The previous detail item for an unchanged title, or None if we have none."""
+        item = self.find(self.carry, {'title': title, 'url': url})
+        if item is not None:
+            self.counts['carried'] += 1
+        else:
+            self.counts['refetch_no_carry'] += 1
+        return item
+
+    def save_snapshot(self, path):
+        rows = sorted(self.current, key=lambda row: row['rank'] if row['rank'] is not None else float('inf'))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=0)
@@ -0,0 +1,45 @@
+"""
+Loading the repo's scripts from other scripts.
+
+detail_data.py, usedb.py and "Load Data to DataBase" start with a note above a
+dashed line, so they are not valid Python files as they are. script_code gives the
+code below that line; load_script imports a script, from that code when a normal
+import does not work (animetodb.py saved as the README says is imported as it is).
+"""
+import importlib
+import sys
+import types
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+
+def load_script(module_name, *candidates):
+    """
+    Import one of the repo's scripts: a normal import if that works (animetodb.py saved
+    as the README says), otherwise the code below the dashed line of the first file found.
+    """
+    try:
+        return importlib.import_module(module_name)
+    except (ImportError, SyntaxError):
+        pass
+    for candidate in candidates:
+        path = HERE / candidate
+        if path.exists():
+            break
+    else:
+        raise ImportError(f"Cannot find {module_name} (looked for {', '.join(candidates)})")
+
+    module = types.ModuleType(module_name)
+    module.__file__ = str(path)
+    sys.modules[module_name] = module
+    exec(compile(script_code(path), str(path), 'exec'), module.__dict__)
+    return module
+
+
+def script_code(path):
+    """The Python code of a repo script: everything below the note's dashed line, if it has one."""
+    lines = Path(path).read_text(encoding='utf-8').splitlines(keepends=True)
+    start = next((i + 1 for i, line in enumerate(lines) if line.startswith('---')), 0)
+    # Blank lines in place of the note keep line numbers in tracebacks right
+    return '\n' * start + ''.join(lines[start:])
@@ -4,6 +4,9 @@ import sqlite3
 import pandas as pd
 import os
 
+from anime_search import best_match, search
+from crawl_stats import StatsRecorder
+
 # Connect to the database
 conn = sqlite3.connect('animelist.db')
 
@@ -21,28 +24,39 @@ def get_top_rated_anime(min_score=8.0):
 
 # Method 2: Exploring Data with Pandas
 def explore_anime_genres():
-    """Get genre distribution"""
+    """Get genre distribution (genre_counts is kept up to date by animetodb.py)"""
     query = """
-    SELECT DISTINCT g.genre_name, COUNT(DISTINCT ag.anime_id) as anime_count
-    FROM genres g
-    JOIN anime_genres ag ON g.genre_id = ag.genre_id
-    GROUP BY g.genre_name
-    ORDER BY anime_count DESC
+    SELECT g.genre_name, gc.anime_count
+    FROM genre_counts gc
+    JOIN genres g ON g.genre_id = gc.genre_id
+    WHERE gc.anime_count > 0
+    ORDER BY gc.anime_count DESC, g.genre_name
     """
     return pd.read_sql_query(query, conn)
 
 # Method 3: Complex Joining
 def get_anime_characters(anime_title):
-    """Find characters for a specific anime"""
+    """Find characters for a specific anime (English/Japanese titles, synonyms and typos work too)"""
+    match = best_match(conn, anime_title)
+    if match is None:
+        print(f"No anime titled '{anime_title}' (try search_anime)")
+    elif match['match'] != 'exact':
+        print(f"No anime titled '{anime_title}', showing '{match['title']}' "
+              f"(matched '{match['matched_name']}', similarity {match['score']})")
     query = """
     SELECT a.title, c.name, c.character_type, va.name as voice_actor
     FROM anime a
     JOIN characters c ON a.anime_id = c.anime_id
     JOIN anime_character_voice acv ON c.character_id = acv.character_id
     JOIN voice_actors va ON acv.voice_actor_id = va.voice_actor_id
-    WHERE a.title = ?
+    WHERE a.anime_id = ?
     """
-    return pd.read_sql_query(query, conn, params=(anime_title,))
+    return pd.read_sql_query(query, conn, params=(match['anime_id'] if match else None,))
+
+def search_anime(text, limit=10):
+    """Ranked title / description search (anime_search.py): exact, full-text, then fuzzy matches"""
+    return pd.DataFrame(search(conn, text, limit),
+                        columns=['anime_id', 'title', 'match', 'score', 'snippet', 'matched_name'])
 
 def check_database_content():
     """Check if the database has any data"""
@@ -65,8 +79,16 @@ def check_database_content():
         if anime_count == 0:
             print("\nWarning: The database appears to be empty!")
             print("Please run animetodb.py first to populate the database.")
+            return False
+
+        # The reports read the summary tables animetodb.py maintains
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'anime_review_summary'")
+        if cursor.fetchone()[0] == 0:
+            print("\nWarning: The summary tables are missing!")
+            print("Please run: python animetodb.py --rebuild-summaries")
+            return False
             
-        return anime_count > 0
+        return True
             
     except sqlite3.OperationalError as e:
         print(f"\nError: {str(e)}")
@@ -99,17 +121,14 @@ def explore_character_voices(limit=10):
 def analyze_character_counts():
     """
     Analyze how many characters each anime has
+    (per-anime counts are stored in anime_character_counts at load time)
     """
     query = """
     SELECT 
-        a.title,
-        COUNT(DISTINCT c.character_id) as character_count,
-        COUNT(DISTINCT va.voice_actor_id) as voice_actor_count
-    FROM anime a
-    JOIN anime_character_voice acv ON a.anime_id = acv.anime_id
-    JOIN characters c ON acv.character_id = c.character_id
-    JOIN voice_actors va ON acv.voice_actor_id = va.voice_actor_id
-    GROUP BY a.title
+        title,
+        character_count,
+        voice_actor_count
+    FROM anime_character_counts
     ORDER BY character_count DESC
     LIMIT 10
     """
@@ -139,20 +158,29 @@ def get_anime_review_summary():
     """
     query = """
     SELECT 
-        a.title as anime_title,
-        a.score,
-        SUM(CASE WHEN r.status = 'Recommended' THEN r.number_of_reviews ELSE 0 END) as recommended,
-        SUM(CASE WHEN r.status = 'Mixed Feelings' THEN r.number_of_reviews ELSE 0 END) as mixed,
-        SUM(CASE WHEN r.status = 'Not Recommended' THEN r.number_of_reviews ELSE 0 END) as not_recommended,
-        SUM(r.number_of_reviews) as total_reviews
-    FROM anime a
-    JOIN reviews r ON a.anime_id = r.anime_id
-    GROUP BY a.title, a.score
+        title as anime_title,
+        score,
+        recommended,
+        mixed,
+        not_recommended,
+        total_reviews
+    FROM anime_review_summary
     ORDER BY total_reviews DESC
     LIMIT 20
     """
     return pd.read_sql_query(query, conn)
 
+def get_review_status_totals():
+    """
+    Total number of reviews per review status over all anime
+    """
+    query = """
+    SELECT status as review_status, number_of_reviews
+    FROM review_status_totals
+    ORDER BY status
+    """
+    return pd.read_sql_query(query, conn)
+
 def main():
     # First check if database has content
     if not check_database_content():
@@ -160,6 +188,8 @@ def main():
         
     # Connect to the database
     conn = sqlite3.connect('animelist.db')
+    # Query latencies, saved as the 'queries' stage of crawl_stats.json (see crawl_stats.py)
+    stats = StatsRecorder('queries')
 
     try:
         # Create directory if it doesn't exist
@@ -170,40 +200,48 @@ def main():
 
         # Top Rated Anime
         print("Saving top rated anime...")
-        top_anime = get_top_rated_anime()
+        with stats.timer('query_seconds', 'get_top_rated_anime', query='get_top_rated_anime'):
+            top_anime = get_top_rated_anime()
         top_anime.to_csv('anime_query/top_rated_anime.csv', index=False)
 
         # Genre Distribution
         print("Saving genre distribution...")
-        genres = explore_anime_genres()
+        with stats.timer('query_seconds', 'explore_anime_genres', query='explore_anime_genres'):
+            genres = explore_anime_genres()
         genres.to_csv('anime_query/genre_distribution.csv', index=False)
         
         # Character Voice Actors
         print("Saving character voice actors sample...")
-        character_voices = explore_character_voices(20)
+        with stats.timer('query_seconds', 'explore_character_voices', query='explore_character_voices'):
+            character_voices = explore_character_voices(20)
         character_voices.to_csv('anime_query/character_voices_sample.csv', index=False)
         
         # Anime Character Counts
         print("Saving character counts...")
-        char_counts = analyze_character_counts()
+        with stats.timer('query_seconds', 'analyze_character_counts', query='analyze_character_counts'):
+            char_counts = analyze_character_counts()
         char_counts.to_csv('anime_query/character_counts.csv', index=False)
         
         # Anime Reviews Statistics
         print("Saving review statistics...")
-        reviews = get_anime_reviews()
+        with stats.timer('query_seconds', 'get_anime_reviews', query='get_anime_reviews'):
+            reviews = get_anime_reviews()
         reviews.to_csv('anime_query/review_statistics.csv', index=False)
         
         # Total Reviews by Status
         print("Saving review status totals...")
-        total_by_status = reviews.groupby('review_status')['number_of_reviews'].sum().reset_index()
+        with stats.timer('query_seconds', 'get_review_status_totals', query='get_review_status_totals'):
+            total_by_status = get_review_status_totals()
         total_by_status.to_csv('anime_query/review_status_totals.csv', index=False)
         
         # Top 20 Anime by Review Count
         print("Saving top reviewed anime...")
-        review_summary = get_anime_review_summary()
+        with stats.timer('query_seconds', 'get_anime_review_summary', query='get_anime_review_summary'):
+            review_summary = get_anime_review_summary()
         review_summary.to_csv('anime_query/top_reviewed_anime.csv', index=False)
         
         print("\nAll query results have been saved to the anime_query directory!")
+        print(f"Query latencies written to {stats.save()}")
         
         # Still print to console for immediate viewing
         print("\nQuery Results Preview:")